@@ -11,10 +11,13 @@ setup(
     download_url='https://github.com/AccentDesign/Accent_SoftDelete/releases/tag/0.0.5',
     license='MIT',
     packages=[
-        'soft_delete'
+        'soft_delete',
+        'soft_delete.management',
+        'soft_delete.management.commands',
+        'soft_delete.migrations',
     ],
     install_requires=[
-        'Django>=1.8',
+        'Django>=1.11',
     ],
     include_package_data=True,
     keywords=['django', 'soft', 'delete', 'accent', 'design'],
@@ -1 +1,3 @@
 __version__ = '0.0.8'
+
+default_app_config = 'soft_delete.apps.SoftDeleteConfig'
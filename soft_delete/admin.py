@@ -0,0 +1,153 @@
+from django.apps import apps
+from django.contrib import admin, messages
+from django.contrib.admin import helpers
+from django.contrib.auth import get_permission_codename
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.template.response import TemplateResponse
+from django.utils.translation import gettext_lazy as _
+
+from .instrumentation import CascadeLimitExceeded
+
+
+class SoftDeleteListFilter(admin.SimpleListFilter):
+    """
+    Filters the change list by active, deleted or all rows, showing the
+    active rows by default.
+    """
+    title = _('deleted')
+    parameter_name = 'deleted'
+
+    def lookups(self, request, model_admin):
+        return (
+            ('deleted', _('Deleted')),
+            ('all', _('All')),
+        )
+
+    def choices(self, changelist):
+        yield {
+            'selected': self.value() is None,
+            'query_string': changelist.get_query_string({}, [self.parameter_name]),
+            'display': _('Active'),
+        }
+        for lookup, title in self.lookup_choices:
+            yield {
+                'selected': self.value() == lookup,
+                'query_string': changelist.get_query_string({self.parameter_name: lookup}, []),
+                'display': title,
+            }
+
+    def queryset(self, request, queryset):
+        if self.value() == 'all':
+            return queryset
+        return queryset.filter(deleted=self.value() == 'deleted')
+
+
+def get_perms_needed(modeladmin, request, counts):
+    """
+    Returns the verbose names of the models in ``counts``, keyed by model
+    label, that the user may not delete. Models registered with the admin
+    site are checked with their admin, others with the delete permission.
+    """
+    perms_needed = set()
+    for label in counts:
+        model = apps.get_model(label)
+        opts = model._meta
+        model_admin = modeladmin.admin_site._registry.get(model)
+        if model_admin is not None:
+            allowed = model_admin.has_delete_permission(request)
+        else:
+            allowed = request.user.has_perm('%s.%s' % (opts.app_label, get_permission_codename('delete', opts)))
+        if not allowed:
+            perms_needed.add(opts.verbose_name)
+    return perms_needed
+
+
+def soft_delete_selected(modeladmin, request, queryset):
+    """
+    Soft deletes the selected rows and their cascade with set based updates,
+    after a confirmation page listing the number of rows affected per model.
+    As with django's ``delete_selected``, the user needs permission to delete
+    every model of the cascade.
+    """
+    if not modeladmin.has_delete_permission(request):
+        raise PermissionDenied
+
+    queryset = queryset.filter(deleted=False)
+    total, counts, samples = queryset.delete_preview()
+    perms_needed = get_perms_needed(modeladmin, request, counts)
+    if request.POST.get('post'):
+        if perms_needed:
+            raise PermissionDenied
+        try:
+            total, rows = queryset.delete()
+        except CascadeLimitExceeded as e:
+            modeladmin.message_user(request, str(e), messages.ERROR)
+        else:
+            modeladmin.message_user(request, _('Soft deleted %(count)d rows.') % {'count': total}, messages.SUCCESS)
+        return None
+
+    opts = modeladmin.model._meta
+    if perms_needed:
+        title = _('Cannot soft delete %(name)s') % {'name': opts.verbose_name_plural}
+    else:
+        title = _('Are you sure?')
+    context = dict(
+        modeladmin.admin_site.each_context(request),
+        title=title,
+        objects_name=opts.verbose_name_plural,
+        counts=[(apps.get_model(label)._meta.verbose_name_plural, count) for label, count in counts.items()],
+        perms_lacking=sorted(perms_needed),
+        pks=queryset.values_list('pk', flat=True),
+        opts=opts,
+        action_checkbox_name=helpers.ACTION_CHECKBOX_NAME,
+        media=modeladmin.media,
+    )
+    request.current_app = modeladmin.admin_site.name
+    return TemplateResponse(request, 'admin/soft_delete/soft_delete_selected_confirmation.html', context)
+
+
+soft_delete_selected.short_description = _('Soft delete selected %(verbose_name_plural)s')
+
+
+def restore_selected(modeladmin, request, queryset):
+    """
+    Restores the selected rows and the rows deleted with them.
+    """
+    if not modeladmin.has_change_permission(request):
+        raise PermissionDenied
+    try:
+        total, rows = queryset.filter(deleted=True).restore()
+    except ValidationError as e:
+        modeladmin.message_user(request, ' '.join(e.messages), messages.ERROR)
+    else:
+        modeladmin.message_user(request, _('Restored %(count)d rows.') % {'count': total}, messages.SUCCESS)
+
+
+restore_selected.short_description = _('Restore selected %(verbose_name_plural)s')
+
+
+class ActiveAdmin(admin.ModelAdmin):
+    """
+    Admin for soft delete models, listing active rows by default with a
+    filter for deleted rows, and actions to soft delete and restore in bulk
+    in place of the stock delete action.
+    """
+    actions = [soft_delete_selected, restore_selected]
+
+    def get_queryset(self, request):
+        queryset = self.model._default_manager.all_with_deleted()
+        ordering = self.get_ordering(request)
+        if ordering:
+            queryset = queryset.order_by(*ordering)
+        return queryset
+
+    def get_list_filter(self, request):
+        list_filter = tuple(super(ActiveAdmin, self).get_list_filter(request))
+        if SoftDeleteListFilter in list_filter:
+            return list_filter
+        return (SoftDeleteListFilter,) + list_filter
+
+    def get_actions(self, request):
+        actions = super(ActiveAdmin, self).get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
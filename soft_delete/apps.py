@@ -0,0 +1,17 @@
+from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_migrate, post_save
+
+
+class SoftDeleteConfig(AppConfig):
+    name = 'soft_delete'
+    verbose_name = 'Soft delete'
+
+    def ready(self):
+        from . import checks  # NOQA
+        from .counters import count_created, count_hard_deleted, counts_rows, create_counters
+
+        for model in self.apps.get_models():
+            if counts_rows(model):
+                post_save.connect(count_created, sender=model, dispatch_uid='soft_delete_counters')
+                post_delete.connect(count_hard_deleted, sender=model, dispatch_uid='soft_delete_counters')
+        post_migrate.connect(create_counters, sender=self, dispatch_uid='soft_delete_counters')
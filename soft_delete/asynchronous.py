@@ -0,0 +1,71 @@
+"""
+Async versions of the soft delete API, for ASGI views. They need Python 3.6
+or later and ``asgiref``, installed with Django 3.0 and later, so they are
+kept out of the other modules. Use the manager and mix the model class in::
+
+    class Child(AsyncSoftDeleteMixin, SoftDeleteAbstract):
+        objects = AsyncSoftDeleteManager()
+
+Django's connections and transactions belong to a thread and there is no
+async database driver, so these run the sync API with ``sync_to_async``, as
+Django's own async queryset methods do. ``adelete()`` and ``arestore()`` run
+the whole cascade in one call so it stays in one transaction, holding the
+sync thread until it is done. ``astream()`` frees it between batches.
+"""
+from asgiref.sync import sync_to_async
+
+from .manager import SoftDeleteManager, SoftDeleteQuerySet
+
+
+class AsyncSoftDeleteQuerySet(SoftDeleteQuerySet):
+
+    async def adelete(self, **kwargs):
+        """
+        Async version of ``delete()``.
+        """
+        return await sync_to_async(self.delete)(**kwargs)
+    adelete.alters_data = True
+
+    async def arestore(self, **kwargs):
+        """
+        Async version of ``restore()``.
+        """
+        return await sync_to_async(self.restore)(**kwargs)
+    arestore.alters_data = True
+
+    async def astream(self, batch_size=1000, fields=None, flat=False):
+        """
+        Async version of ``stream()``, for ``async for``. Each batch is fetched
+        in its own call to the sync thread, which is free between batches.
+        """
+        batches = self._stream_batches(batch_size, fields, flat)
+        while True:
+            batch = await sync_to_async(next)(batches, None)
+            if batch is None:
+                return
+            for row in batch:
+                yield row
+
+
+class AsyncSoftDeleteManager(SoftDeleteManager):
+    _queryset_class = AsyncSoftDeleteQuerySet
+
+    async def aget(self, allow_deleted=False, *args, **kwargs):
+        """
+        Async version of ``get()``.
+        """
+        return await sync_to_async(self.get)(allow_deleted, *args, **kwargs)
+
+
+class AsyncSoftDeleteMixin(object):
+    """
+    Adds ``adelete()`` and ``arestore()`` to a soft delete model.
+    """
+
+    async def adelete(self, **kwargs):
+        return await sync_to_async(self.delete)(**kwargs)
+    adelete.alters_data = True
+
+    async def arestore(self, cascade=True):
+        return await sync_to_async(self.restore)(cascade)
+    arestore.alters_data = True
@@ -0,0 +1,99 @@
+"""
+Opt-in caching of primary key lookups, enabled per model with
+``SoftDeleteManager(cache_timeout=...)``. Rows are cached under a version per
+model and database, which is replaced whenever rows of the model are saved,
+deleted, soft deleted, restored or updated, so a deleted row is never served
+as it was before the delete. The version is that of the database written to,
+so rows read from a replica are dropped by writes to its primary. Rows read
+inside a transaction are not cached, as the transaction may be rolled back.
+"""
+import uuid
+
+from django.apps import apps
+from django.core.cache import caches
+from django.db import connections, router, transaction
+from django.db.models.signals import post_delete, post_save
+
+from .signals import post_soft_delete
+
+
+def cached_managers(model):
+    return [manager for manager in model._meta.managers if getattr(manager, 'cache_timeout', None)]
+
+
+def version_key(model, using):
+    return 'soft_delete:%s:%s' % (model._meta.label, using)
+
+
+def get_version(cache, model, using):
+    key = version_key(model, using)
+    version = cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+def replace_versions(model, using):
+    for manager in cached_managers(model):
+        caches[manager.cache_alias].set(version_key(model, using), uuid.uuid4().hex, None)
+
+
+def invalidate(model, using):
+    """
+    Drops the cached rows of the model, now and again once the transaction
+    commits, in case rows were cached from other connections in between.
+    """
+    if not cached_managers(model):
+        return
+    replace_versions(model, using)
+    transaction.on_commit(lambda: replace_versions(model, using), using=using)
+
+
+def invalidate_rows(rows, using):
+    """
+    Drops the cached rows of each model in a dict of rows keyed by model label,
+    of ``using`` and of the database the model is routed to, where a cascade
+    from ``using`` wrote them.
+    """
+    for label in rows:
+        model = apps.get_model(label)
+        invalidate(model, using)
+        routed = router.db_for_write(model)
+        if routed != using:
+            invalidate(model, routed)
+
+
+def cached_get(manager, pk):
+    cache = caches[manager.cache_alias]
+    # writes, and so invalidation, go to the database routed for writes
+    using = manager._db or router.db_for_write(manager.model)
+    key = '%s:%s:%s' % (version_key(manager.model, using), get_version(cache, manager.model, using), pk)
+    obj = cache.get(key)
+    if obj is None:
+        obj = manager.all_with_deleted().get(pk=pk)
+        if not connections[obj._state.db].in_atomic_block:
+            cache.set(key, obj, manager.cache_timeout)
+    return obj
+
+
+def invalidate_instance(sender, using, **kwargs):
+    invalidate(sender, using)
+
+
+def invalidate_soft_delete(sender, rows, using, **kwargs):
+    invalidate_rows(rows, using)
+
+
+def connect_invalidation(model):
+    """
+    Connects the save and delete signals of a model with a cached manager.
+    Only these models are connected as delete receivers stop django from
+    deleting rows without fetching them first.
+    """
+    post_save.connect(invalidate_instance, sender=model, dispatch_uid='soft_delete_cache')
+    post_delete.connect(invalidate_instance, sender=model, dispatch_uid='soft_delete_cache')
+
+
+post_soft_delete.connect(invalidate_soft_delete)
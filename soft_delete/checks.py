@@ -0,0 +1,96 @@
+from django.apps import apps
+from django.core.checks import Error, Tags, Warning, register
+from django.db.migrations.loader import MigrationLoader
+
+from .constraints import active_unique_checks
+from .triggers import InstallSoftDeleteTriggers, trigger_fingerprint
+from .utils import is_soft_delete_model
+
+
+def get_models(app_configs):
+    if app_configs is None:
+        return apps.get_models()
+    return (model for app_config in app_configs for model in app_config.get_models())
+
+
+@register(Tags.models)
+def check_active_unique_constraints(app_configs=None, **kwargs):
+    """
+    Warns when fields with an active unique constraint are also unique across
+    all rows, as the full constraint would still reject reusing the values
+    of deleted rows.
+    """
+    errors = []
+    for model in get_models(app_configs):
+        if not is_soft_delete_model(model):
+            continue
+        unique_together = {frozenset(fields) for fields in model._meta.unique_together}
+        for model_class, fields in active_unique_checks(model):
+            if model_class is not model:
+                continue
+            if frozenset(fields) in unique_together or (
+                    len(fields) == 1 and model._meta.get_field(fields[0]).unique):
+                errors.append(Warning(
+                    '%s has an active unique constraint on %s that is also unique across deleted rows.' % (
+                        model._meta.label, ', '.join(fields)),
+                    hint='Remove unique=True or the unique_together entry so deleted values can be reused.',
+                    obj=model,
+                    id='soft_delete.W001',
+                ))
+    return errors
+
+
+def installed_trigger(loader, model):
+    """
+    Returns the migration that last installed the trigger of the model, or
+    None if none did.
+    """
+    app_label = model._meta.app_label
+    installed = None
+    for node in loader.graph.leaf_nodes(app_label):
+        for key in loader.graph.forwards_plan(node):
+            if key[0] != app_label:
+                continue
+            for operation in loader.graph.nodes[key].operations:
+                if not isinstance(operation, InstallSoftDeleteTriggers):
+                    continue
+                if operation.model_name.lower() == model._meta.model_name:
+                    installed = key
+    return installed
+
+
+@register(Tags.models)
+def check_soft_delete_triggers(app_configs=None, **kwargs):
+    """
+    Errors when a model with ``soft_delete_triggers`` has no trigger installed
+    by its migrations, or its relations changed since the trigger was, as its
+    deletes would trust the trigger to follow relations it does not.
+    """
+    models = [model for model in get_models(app_configs) if getattr(model, 'soft_delete_triggers', False)]
+    if not models:
+        return []
+    loader = MigrationLoader(None, ignore_no_migrations=True)
+    errors = []
+    for model in models:
+        if model._meta.app_label in loader.unmigrated_apps:
+            continue
+        installed = installed_trigger(loader, model)
+        if installed is None:
+            errors.append(Error(
+                '%s sets soft_delete_triggers but no migration installs its trigger.' % model._meta.label,
+                hint="Add InstallSoftDeleteTriggers('%s') to a migration." % model.__name__,
+                obj=model,
+                id='soft_delete.E001',
+            ))
+            continue
+        state = loader.project_state(installed, at_end=True)
+        historical = state.apps.get_model(model._meta.app_label, model._meta.model_name)
+        if trigger_fingerprint(historical) != trigger_fingerprint(model):
+            errors.append(Error(
+                'The trigger of %s installed by migration %s does not follow its current relations.' % (
+                    model._meta.label, installed[1]),
+                hint="Add InstallSoftDeleteTriggers('%s') to a new migration." % model.__name__,
+                obj=model,
+                id='soft_delete.E002',
+            ))
+    return errors
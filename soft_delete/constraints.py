@@ -0,0 +1,65 @@
+"""
+Partial indexes and unique constraints covering only the active rows of a
+soft delete model, for use in ``Meta.indexes`` and ``Meta.constraints``::
+
+    class Meta:
+        constraints = [active_unique_constraint(['name'], 'unique_active_name')]
+        indexes = [active_index(['age', 'gender'], 'active_age_gender')]
+
+Every default query filters ``deleted=False`` so these stay small and
+selective. Active unique constraints only require values to be unique among
+active rows, which ``SoftDeleteAbstract`` validation follows. Conditions on
+indexes and constraints need Django 2.2 or later.
+"""
+import django
+from django.core.exceptions import ImproperlyConfigured
+from django.db import models
+from django.db.models import Q
+
+
+def active_condition():
+    return Q(deleted=False)
+
+
+def supports_conditions():
+    return django.VERSION >= (2, 2)
+
+
+def _check_supported():
+    if not supports_conditions():
+        raise ImproperlyConfigured('Partial indexes and constraints need Django 2.2 or later.')
+
+
+def active_index(fields, name, **kwargs):
+    """
+    Returns an index on the fields covering active rows only.
+    """
+    _check_supported()
+    return models.Index(fields=fields, name=name, condition=active_condition(), **kwargs)
+
+
+def active_unique_constraint(fields, name, **kwargs):
+    """
+    Returns a unique constraint on the fields among active rows only.
+    """
+    _check_supported()
+    return models.UniqueConstraint(fields=fields, name=name, condition=active_condition(), **kwargs)
+
+
+def is_active_unique_constraint(constraint):
+    if not isinstance(constraint, getattr(models, 'UniqueConstraint', ())):
+        return False
+    return constraint.condition == active_condition()
+
+
+def active_unique_checks(model):
+    """
+    Returns ``(model_class, fields)`` unique checks for the active unique
+    constraints of the model and its parents.
+    """
+    checks = []
+    for model_class in [model] + model._meta.get_parent_list():
+        for constraint in getattr(model_class._meta, 'constraints', ()):
+            if is_active_unique_constraint(constraint):
+                checks.append((model_class, tuple(constraint.fields)))
+    return checks
@@ -0,0 +1,102 @@
+"""
+Counts of active and deleted rows, from one aggregate query or, for models
+with ``soft_delete_counters = True``, from a ``SoftDeleteCounter`` row kept
+up to date in the same transaction as each create, soft delete, restore and
+hard delete made through the package. Writes that bypass it, such as
+``bulk_create()`` or ``update(deleted=...)``, need ``refresh_counters()``.
+
+Counters are created by counting the rows of the model after ``migrate``, or
+when first read, and writes only ever update them.
+"""
+from django.apps import apps
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import Case, F, IntegerField, Sum, When
+
+
+def counts_rows(model):
+    return getattr(model, 'soft_delete_counters', False)
+
+
+def row_stats(queryset):
+    """
+    Returns the active, deleted and total rows of the queryset in one query.
+    """
+    def count(deleted):
+        return Sum(Case(When(deleted=deleted, then=1), default=0, output_field=IntegerField()))
+
+    stats = queryset.aggregate(active=count(False), deleted=count(True))
+    stats = dict((key, value or 0) for key, value in stats.items())
+    stats['total'] = stats['active'] + stats['deleted']
+    return stats
+
+
+def refresh_counters(model, using):
+    """
+    Recounts the rows of the model into its counter, returning the counts.
+    """
+    from .models import SoftDeleteCounter
+    stats = row_stats(model._base_manager.using(using))
+    values = {'active': stats['active'], 'deleted': stats['deleted']}
+    counters = SoftDeleteCounter.objects.using(using).filter(model=model._meta.label)
+    if not counters.update(**values):
+        try:
+            with transaction.atomic(using=using):
+                counters.create(model=model._meta.label, **values)
+        except IntegrityError:
+            # created by another connection in between
+            counters.update(**values)
+    return stats
+
+
+def create_counters(using, **kwargs):
+    """
+    Creates the missing counters of the counted models, after ``migrate``.
+    """
+    from .models import SoftDeleteCounter
+    tables = connections[using].introspection.table_names()
+    if SoftDeleteCounter._meta.db_table not in tables or not router.allow_migrate_model(using, SoftDeleteCounter):
+        return
+    existing = set(SoftDeleteCounter.objects.using(using).values_list('model', flat=True))
+    for model in apps.get_models():
+        if not counts_rows(model) or model._meta.label in existing or model._meta.db_table not in tables:
+            continue
+        if router.allow_migrate_model(using, model):
+            refresh_counters(model, using)
+
+
+def read_counters(model, using):
+    from .models import SoftDeleteCounter
+    counter = SoftDeleteCounter.objects.using(using).filter(model=model._meta.label).first()
+    if counter is None:
+        return refresh_counters(model, using)
+    return {'active': counter.active, 'deleted': counter.deleted, 'total': counter.active + counter.deleted}
+
+
+def add_counts(model, using, active=0, deleted=0):
+    """
+    Adds to the counts of the model, if counted, after rows have changed. A
+    counter not created yet is left to be created, counting these rows, when
+    first read.
+    """
+    from .models import SoftDeleteCounter
+    if not counts_rows(model) or not (active or deleted):
+        return
+    counters = SoftDeleteCounter.objects.using(using).filter(model=model._meta.label)
+    counters.update(active=F('active') + active, deleted=F('deleted') + deleted)
+
+
+def count_deleted(model, using, rows):
+    add_counts(model, using, active=-rows, deleted=rows)
+
+
+def count_restored(model, using, rows):
+    add_counts(model, using, active=rows, deleted=-rows)
+
+
+def count_created(sender, instance, created, using, **kwargs):
+    if created:
+        add_counts(sender, using, deleted=int(instance.deleted), active=int(not instance.deleted))
+
+
+def count_hard_deleted(sender, instance, using, **kwargs):
+    add_counts(sender, using, deleted=-int(instance.deleted), active=-int(not instance.deleted))
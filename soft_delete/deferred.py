@@ -0,0 +1,134 @@
+"""
+Deferred cascades for soft deletes. The rows deleted are flagged straight away
+and the rest of the cascade is queued in the database, to be finished by the
+``process_soft_delete_jobs`` worker in resumable chunks.
+"""
+import json
+from collections import Counter
+from functools import partial
+
+from django.apps import apps
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, router, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .cache import invalidate
+from .counters import count_deleted
+from .models import SoftDeleteJob, SoftDeleteJobBatch
+from .utils import SoftDeleteCollector, deletion_values, is_soft_delete_model
+
+
+def flag_batch(model, pks, collector):
+    """
+    Flags the rows of a batch still active, returning the number flagged.
+    """
+    using = collector.db_for(model)
+    batch_qs = model._base_manager.using(using).filter(pk__in=pks, deleted=False)
+    rows = batch_qs.update(**deletion_values(model, collector.deletion_batch, collector.deleted_at))
+    count_deleted(model, using, rows)
+    return rows
+
+
+def flag_batches(collector, using, batches):
+    """
+    Flags the rows of the ``(model, pks)`` batches of a database still active,
+    deleting those of models that are not soft deletable. Returns a counter of
+    the rows affected keyed by model label.
+    """
+    counts = Counter()
+    for model, pks in batches:
+        if is_soft_delete_model(model):
+            counts[model._meta.label] += flag_batch(model, pks, collector)
+        else:
+            counts.update(model._base_manager.using(using).filter(pk__in=pks).delete()[1])
+    return counts
+
+
+def queue_batch(job, model, pks):
+    SoftDeleteJobBatch.objects.using(job._state.db).create(
+        job=job, model=model._meta.label, pks=json.dumps(pks, cls=DjangoJSONEncoder))
+
+
+def defer_cascade(queryset, collector):
+    """
+    Flags the active rows of the queryset and queues a job to cascade from
+    them, on the same database so both are committed together. Returns a
+    counter of the rows flagged keyed by model label.
+    """
+    job = None
+    counts = Counter()
+    pks = queryset.filter(deleted=False).values_list('pk', flat=True).iterator()
+    for model, batch in collector.batches(queryset.model, pks):
+        if job is None:
+            job = SoftDeleteJob.objects.db_manager(collector.using).create(
+                model=model._meta.label, using=collector.using, deletion_batch=collector.deletion_batch)
+        counts[model._meta.label] += flag_batch(model, batch, collector)
+        queue_batch(job, model, batch)
+    if job is not None:
+        job.rows = sum(counts.values())
+        job.save(update_fields=['rows'])
+    return counts
+
+
+def next_batch(using):
+    """
+    Returns the next queued batch, locking it where the database can skip
+    batches locked by other workers. Its job is not locked, so several workers
+    can process the batches of one job at once.
+    """
+    batches = SoftDeleteJobBatch.objects.using(using)
+    if connections[using].features.has_select_for_update_skip_locked:
+        batches = batches.select_for_update(skip_locked=True)
+    return batches.first()
+
+
+def process_batch(batch, batch_size=None):
+    """
+    Runs the next level of the cascade from a queued batch: flags its active
+    dependents, queues them in turn and removes the batch, finishing the job
+    when none are left. Returns the number of rows affected.
+    """
+    job = batch.job
+    collector = SoftDeleteCollector(job.using, batch_size, job.deletion_batch)
+    collector.deleted_at = job.created_at
+    collector.model = apps.get_model(job.model)
+    level = [(apps.get_model(batch.model), json.loads(batch.pks))]
+    with collector, transaction.atomic(using=job.using):
+        children = list(collector.children(level))
+        counts = collector.by_alias(children, partial(flag_batches, collector))
+        for model, pks in children:
+            if is_soft_delete_model(model):
+                queue_batch(job, model, pks)
+    for label in counts:
+        model = apps.get_model(label)
+        invalidate(model, collector.db_for(model))
+    batch.delete()
+
+    rows = sum(counts.values())
+    # the update locks the job until the batch is committed, so of the workers
+    # processing its last batches the last to commit finds none left
+    jobs = SoftDeleteJob.objects.using(job._state.db).filter(pk=job.pk)
+    jobs.update(rows=F('rows') + rows)
+    if not job.batches.exists():
+        jobs.update(finished_at=timezone.now())
+    return rows
+
+
+def process_jobs(max_batches=None, batch_size=None, using=None):
+    """
+    Processes the batches queued on the ``using`` database, by default the one
+    routed for writes of jobs, until none are left or ``max_batches`` have been
+    processed. Each batch is committed on its own so an interrupted worker
+    resumes where it stopped. Returns the number of batches processed.
+    """
+    using = using or router.db_for_write(SoftDeleteJobBatch)
+    processed = 0
+    while max_batches is None or processed < max_batches:
+        with transaction.atomic(using=using):
+            batch = next_batch(using)
+            if batch is None:
+                break
+            process_batch(batch, batch_size)
+        processed += 1
+    return processed
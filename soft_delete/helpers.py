@@ -1,10 +1,66 @@
+from django.db.models import Prefetch
+
+from .manager import SoftDeleteQuerySet
+
+
 # helper to render a foreign key field with the selected
 # value if it is already deleted
 
 
 def set_soft_delete_foreign_key(field, instance, instance_attr, related_class):
-    if instance.id and hasattr(instance, instance_attr):
-        field.queryset = related_class.objects.all_including_by_pk(getattr(instance, instance_attr).pk)
+    # read the selected value from the id attribute, not the related object,
+    # so the selected row is not fetched as well, it is the value of the
+    # field the foreign key targets
+    foreign_key = instance._meta.get_field(instance_attr)
+    value = getattr(instance, foreign_key.attname)
+    if instance.id and value is not None:
+        field.queryset = related_class.objects.all_including_pks([value], foreign_key.remote_field.field_name)
     else:
         field.queryset = related_class.objects.all()
     return field
+
+
+def set_soft_delete_formset_foreign_key(formset, field_name, related_class, lazy=False):
+    """
+    Sets the choices of the ``field_name`` foreign key field of every form in
+    a formset to the active rows plus the rows selected in any of the forms,
+    fetched with one query and shared by all the forms rather than one query
+    per form.
+
+    With ``lazy`` the choices are only the selected rows, for related tables
+    too large to list, leaving other rows to be found by an autocomplete
+    widget. Submitted values are still validated against every active row.
+    """
+    forms = formset.forms
+    if not forms:
+        return formset
+    foreign_key = forms[0]._meta.model._meta.get_field(field_name)
+    # the values of the field the foreign key targets, the pk unless to_field is set
+    target = foreign_key.remote_field.field_name
+    values = set(getattr(form.instance, foreign_key.attname) for form in forms if form.instance.pk) - {None}
+    queryset = related_class.objects.all_including_pks(values, target)
+
+    field = forms[0].fields[field_name]
+    iterator = field.iterator(field)
+    choices = [('', field.empty_label)] if field.empty_label is not None else []
+    if lazy:
+        selected = related_class.objects.all_with_deleted().filter(**{'%s__in' % target: values})
+        choices.extend(iterator.choice(obj) for obj in selected)
+    else:
+        choices.extend(iterator.choice(obj) for obj in queryset)
+
+    for form in forms:
+        form.fields[field_name].queryset = queryset
+        form.fields[field_name].choices = choices
+    return formset
+
+
+def soft_delete_prefetch(lookup, model, include_deleted=False, to_attr=None):
+    """
+    Returns a ``Prefetch`` of the ``model`` rows related by ``lookup``.
+    Related managers leave out deleted rows, and rows linked by deleted
+    through model rows, so with ``include_deleted`` all rows are prefetched
+    instead, in the same single query.
+    """
+    queryset = SoftDeleteQuerySet(model) if include_deleted else None
+    return Prefetch(lookup, queryset=queryset, to_attr=to_attr)
@@ -0,0 +1,131 @@
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.db import connections
+
+from .signals import post_soft_delete, pre_soft_delete
+
+_local = threading.local()
+
+
+class CascadeLimitExceeded(Exception):
+    def __init__(self, msg, rows):
+        self.rows = rows
+        super(CascadeLimitExceeded, self).__init__(msg, rows)
+
+
+def get_max_cascade_rows(max_cascade_rows=None):
+    if max_cascade_rows is None:
+        return getattr(settings, 'SOFT_DELETE_MAX_CASCADE_ROWS', None)
+    return max_cascade_rows
+
+
+def check_cascade_rows(model, rows, max_cascade_rows):
+    """
+    Raises ``CascadeLimitExceeded`` when the rows a delete would affect, by
+    model label, are more than ``max_cascade_rows``.
+    """
+    total = sum(rows.values())
+    if max_cascade_rows is not None and total > max_cascade_rows:
+        raise CascadeLimitExceeded(
+            'Deleting %s would affect %d rows, more than the limit of %d.' % (
+                model._meta.label, total, max_cascade_rows),
+            dict(rows),
+        )
+
+
+class QueryCounter(object):
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class SoftDeleteOperation(object):
+    """
+    Times a soft delete and counts the rows and queries it affects, sending
+    ``pre_soft_delete`` on entry and ``post_soft_delete`` on success.
+
+    Operations started inside another, such as the deletes of each object
+    in a cascade, are nested and add their rows to the outermost operation,
+    sharing its ``deletion_batch`` unless given their own. Queries are counted
+    with a connection execute wrapper, from django 2.0.
+    """
+
+    def __init__(self, model, using, deletion_batch=None):
+        self.model = model
+        self.using = using
+        self.deletion_batch = deletion_batch
+        self.rows = Counter()
+        # (model, pk) of the objects deleted, so cycles are only followed once
+        self.seen = set()
+        self.outer = None
+        self.counter = None
+        self.wrapper = None
+
+    @property
+    def nested(self):
+        return self.outer is not None
+
+    def visit(self, obj):
+        """
+        Records the object as deleted by the outermost operation, returning
+        False if it already was.
+        """
+        seen = (self.outer or self).seen
+        key = (obj.__class__, obj.pk)
+        if key in seen:
+            return False
+        seen.add(key)
+        return True
+
+    def get_deletion_batch(self):
+        """
+        Returns the batch id of the operation, or of the outermost operation,
+        created on first use.
+        """
+        if self.deletion_batch is not None:
+            return self.deletion_batch
+        operation = self.outer or self
+        if operation.deletion_batch is None:
+            operation.deletion_batch = uuid.uuid4()
+        return operation.deletion_batch
+
+    def add(self, rows):
+        operation = self.outer or self
+        operation.rows.update(rows)
+
+    def __enter__(self):
+        self.outer = getattr(_local, 'operation', None)
+        if self.nested:
+            return self
+        _local.operation = self
+        pre_soft_delete.send(sender=self.model, using=self.using)
+        connection = connections[self.using]
+        if hasattr(connection, 'execute_wrapper'):
+            self.counter = QueryCounter()
+            self.wrapper = connection.execute_wrapper(self.counter)
+            self.wrapper.__enter__()
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.nested:
+            return
+        elapsed = time.time() - self.start
+        _local.operation = None
+        if self.wrapper is not None:
+            self.wrapper.__exit__(exc_type, exc_value, traceback)
+        if exc_type is None:
+            post_soft_delete.send(
+                sender=self.model,
+                rows=dict(self.rows),
+                queries=self.counter.count if self.counter else None,
+                elapsed=elapsed,
+                using=self.using,
+            )
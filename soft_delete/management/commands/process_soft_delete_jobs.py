@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from soft_delete.deferred import process_jobs
+
+
+class Command(BaseCommand):
+    help = 'Runs the cascades of deferred soft deletes queued in the database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true', dest='once',
+            help='Exit once the queue is empty instead of waiting for more jobs.')
+        parser.add_argument(
+            '--sleep', type=float, default=5,
+            help='Seconds to wait before checking an empty queue again.')
+        parser.add_argument(
+            '--max-batches', type=int, dest='max_batches',
+            help='Exit after processing this many batches.')
+        parser.add_argument(
+            '--batch-size', type=int, dest='batch_size',
+            help='Number of primary keys per queued batch.')
+        parser.add_argument(
+            '--database', dest='database',
+            help='The database whose jobs are processed, the one routed for writes of jobs when omitted.')
+
+    def handle(self, *args, **options):
+        max_batches = options['max_batches']
+        total = 0
+        while True:
+            remaining = None if max_batches is None else max_batches - total
+            processed = process_jobs(
+                max_batches=remaining, batch_size=options['batch_size'], using=options['database'])
+            total += processed
+            if processed:
+                self.stdout.write('Processed %d batches' % processed)
+            if options['once'] or (max_batches is not None and total >= max_batches):
+                break
+            if not processed:
+                time.sleep(options['sleep'])
@@ -0,0 +1,72 @@
+from datetime import timedelta
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from soft_delete.utils import is_soft_delete_model, tracks_deletions
+
+
+class Command(BaseCommand):
+    help = 'Physically deletes soft deleted rows in chunks, dependent rows first.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'models', nargs='*', metavar='app_label.ModelName',
+            help='Models to purge, all soft delete models when omitted.')
+        parser.add_argument(
+            '--older-than-days', type=int, dest='older_than_days',
+            help='Only purge rows deleted more than this many days ago.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000, dest='chunk_size',
+            help='Number of rows deleted per transaction.')
+        parser.add_argument(
+            '--sleep', type=float, default=0,
+            help='Seconds to pause between chunks.')
+        parser.add_argument(
+            '--lock-timeout', type=float, dest='lock_timeout',
+            help='Seconds to wait for locks before giving up, on PostgreSQL.')
+        parser.add_argument(
+            '--database', dest='database',
+            help='The database to purge, the one routed for writes when omitted.')
+        parser.add_argument(
+            '--dry-run', action='store_true', dest='dry_run',
+            help='Only count the rows that would be purged.')
+
+    def get_models(self, labels, older_than):
+        if not labels:
+            return [
+                model for model in apps.get_models()
+                if is_soft_delete_model(model) and (older_than is None or tracks_deletions(model))
+            ]
+        models = []
+        for label in labels:
+            try:
+                model = apps.get_model(label)
+            except (LookupError, ValueError) as e:
+                raise CommandError(str(e))
+            if not is_soft_delete_model(model):
+                raise CommandError('%s is not a soft delete model.' % label)
+            models.append(model)
+        return models
+
+    def handle(self, *args, **options):
+        older_than = None
+        if options['older_than_days'] is not None:
+            older_than = timedelta(days=options['older_than_days'])
+        for model in self.get_models(options['models'], older_than):
+            manager = model._default_manager.db_manager(options['database'])
+            try:
+                counts = manager.purge(
+                    older_than=older_than,
+                    chunk_size=options['chunk_size'],
+                    sleep=options['sleep'],
+                    lock_timeout=options['lock_timeout'],
+                    dry_run=options['dry_run'],
+                )
+            except ValueError as e:
+                raise CommandError(str(e))
+            for label, count in sorted(counts.items()):
+                if options['dry_run']:
+                    self.stdout.write('Would purge %d %s' % (count, label))
+                else:
+                    self.stdout.write('Purged %d %s' % (count, label))
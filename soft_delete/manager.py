@@ -1,34 +1,235 @@
-from django.db import models
+import uuid
+from collections import Counter
+
+from django.db import models, router, transaction
 from django.db.models import Q
+from django.utils import timezone
+
+from .cache import cached_get, connect_invalidation, invalidate, invalidate_rows
+from .counters import counts_rows, read_counters, refresh_counters, row_stats
+from .instrumentation import SoftDeleteOperation, check_cascade_rows, get_max_cascade_rows
+from .purge import SoftDeletePurger
+from .utils import SoftDeleteCollector, bulk_unique_errors, is_soft_delete_model, restore_batch, tracks_deletions
 
 
 class SoftDeleteQuerySet(models.query.QuerySet):
+    # set by the manager's using(), so Model.objects.using(alias).deleted()
+    # and all_with_deleted() work as they do on the manager
+    _soft_delete_default = False
+
     def active(self):
         return self.filter(deleted=False)
 
     def deleted(self):
+        if self._soft_delete_default:
+            return self.all_with_deleted().deleted()
         return self.filter(deleted=True)
 
-    def delete(self):
+    def all_with_deleted(self):
+        """
+        Returns every row, deleted or not, of the database of
+        ``Model.objects.using(alias)``.
+        """
+        if not self._soft_delete_default:
+            raise TypeError('all_with_deleted() can only follow the manager or its using().')
+        return self.__class__(self.model, using=self._db)
+
+    def all_including_by_pk(self, pk=None):
+        if pk:
+            return self.all_with_deleted().filter(Q(deleted=False) | Q(pk=pk))
+        return self
+
+    def using(self, alias):
+        clone = super(SoftDeleteQuerySet, self).using(alias)
+        clone._soft_delete_default = self._soft_delete_default
+        # related managers call using() between the through filter of
+        # SoftDeleteManager._active_through and their own, whose join it shares
+        clone.query.filter_is_sticky = self.query.filter_is_sticky
+        return clone
+
+    def stats(self):
+        """
+        Returns the ``active``, ``deleted`` and ``total`` rows of the queryset
+        counted with one conditional aggregate query.
+        """
+        return row_stats(self)
+
+    def update(self, **kwargs):
+        rows = super(SoftDeleteQuerySet, self).update(**kwargs)
+        invalidate(self.model, self.db)
+        return rows
+    update.alters_data = True
+
+    def delete(self, bulk=True, batch_size=None, deletion_batch=None, max_cascade_rows=None, deferred=False):
+        """
+        Soft delete every object in the queryset.
+
+        By default the rows and their cascade are flagged with set based updates
+        and the number of rows affected is returned in the same form as django's
+        own delete. Pass ``bulk=False`` to call ``delete()`` on each object
+        instead, for models that rely on an overridden ``delete()``, which
+        returns the rows affected in the same form.
+
+        The cascade is collected breadth first in batches of ``batch_size``
+        primary keys, see ``SoftDeleteCollector``. Models that track deletions
+        record ``deletion_batch``, or a new batch id, so the whole operation can
+        be undone with ``restore_batch``.
+
+        ``pre_soft_delete`` and ``post_soft_delete`` are sent around the whole
+        operation. If it would affect more than ``max_cascade_rows`` rows, or
+        the ``SOFT_DELETE_MAX_CASCADE_ROWS`` setting, ``CascadeLimitExceeded``
+        is raised before anything is changed.
+
+        With ``deferred`` only the rows of the queryset are flagged, and the
+        rest of the cascade is queued for the ``process_soft_delete_jobs``
+        worker, so the time taken does not grow with the size of the cascade.
+        The cascade is not collected, so it cannot be limited, and the
+        ``SOFT_DELETE_MAX_CASCADE_ROWS`` setting does not apply.
+        """
         assert self.query.can_filter(), "Cannot use 'limit' or 'offset' with delete."
-        for object in self.all():
-            object.delete()
+        if deferred and not bulk:
+            raise TypeError('A deferred delete cannot call delete() on each object.')
+        if deferred and max_cascade_rows is not None:
+            raise TypeError('A deferred delete does not collect its cascade, max_cascade_rows cannot limit it.')
+        del_query = self._clone()
+        del_query._for_write = True
+        if not deferred:
+            max_cascade_rows = get_max_cascade_rows(max_cascade_rows)
+        collector = SoftDeleteCollector(del_query.db, batch_size, deletion_batch)
+
+        with SoftDeleteOperation(self.model, del_query.db, collector.deletion_batch) as operation:
+            if not bulk:
+                if max_cascade_rows is not None:
+                    check_cascade_rows(self.model, collector.count(del_query), max_cascade_rows)
+                # the objects' deletes add their rows to the outermost operation
+                rows = operation.outer or operation
+                before = Counter(rows.rows)
+                for object in del_query:
+                    # skip objects already deleted, or deleted by the cascade of
+                    # another, the objects' deletes share the operation's batch
+                    if not object.deleted and (object.__class__, object.pk) not in rows.seen:
+                        object.delete()
+                counts = rows.rows - before
+                self._result_cache = None
+                return sum(counts.values()), dict(counts)
+
+            with collector, transaction.atomic(using=del_query.db):
+                if deferred:
+                    from .deferred import defer_cascade
+                    counts = defer_cascade(del_query, collector)
+                else:
+                    counts = collector.delete(del_query, max_cascade_rows)
+            operation.add(counts)
         self._result_cache = None
+        return sum(counts.values()), dict(counts)
     delete.alters_data = True
 
+    def delete_preview(self, sample_size=0):
+        """
+        Returns ``(total, counts, samples)`` for a soft delete of the queryset
+        without changing anything: the rows it would affect, in total and by
+        model label, and up to ``sample_size`` primary keys of each model.
+        """
+        assert self.query.can_filter(), "Cannot use 'limit' or 'offset' with delete_preview."
+        return SoftDeleteCollector(self.db).preview(self._clone(), sample_size)
+
+    def restore(self, cascade=True, batch_size=None):
+        """
+        Restore every deleted object in the queryset with set based updates,
+        and with ``cascade`` the objects that were deleted along with them.
+
+        Raises ``ValidationError`` without restoring anything if a restored row
+        would duplicate the unique values of an active row.
+        """
+        assert self.query.can_filter(), "Cannot use 'limit' or 'offset' with restore."
+        restore_query = self._clone()
+        restore_query._for_write = True
+        collector = SoftDeleteCollector(restore_query.db, batch_size)
+        with collector, transaction.atomic(using=restore_query.db):
+            counts = collector.restore(restore_query, cascade)
+        invalidate_rows(counts, restore_query.db)
+        self._result_cache = None
+        return sum(counts.values()), dict(counts)
+    restore.alters_data = True
+
+    def stream(self, batch_size=1000, fields=None, flat=False):
+        """
+        Yields the objects of the queryset in primary key order, fetching
+        ``batch_size`` rows per query by keyset pagination on the primary key
+        rather than OFFSET, so memory and the cost of each query stay constant
+        however large the table.
+
+        Given ``fields`` tuples of those field values are yielded instead of
+        objects, or single values with ``flat``, as ``values_list`` would.
+        """
+        for batch in self._stream_batches(batch_size, fields, flat):
+            for row in batch:
+                yield row
+
+    def _stream_batches(self, batch_size, fields, flat):
+        assert self.query.can_filter(), "Cannot use 'limit' or 'offset' with stream."
+        if flat and (not fields or len(fields) > 1):
+            raise TypeError("'flat' is only valid with a single field.")
+        queryset = self.order_by('pk')
+        if fields:
+            queryset = queryset.values_list('pk', *fields)
+        last_pk = None
+        while True:
+            batch_qs = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            batch = list(batch_qs[:batch_size])
+            if not fields:
+                yield batch
+            elif flat:
+                yield [row[1] for row in batch]
+            else:
+                yield [row[1:] for row in batch]
+            if len(batch) < batch_size:
+                return
+            last_pk = batch[-1][0] if fields else batch[-1].pk
+
 
 class SoftDeleteManager(models.Manager):
+    """
+    With ``cache_timeout`` the objects fetched by ``get(pk=...)`` are cached
+    for that many seconds in the ``cache_alias`` cache, see
+    ``soft_delete.cache``.
+    """
+
+    _queryset_class = SoftDeleteQuerySet
+
+    def __init__(self, cache_timeout=None, cache_alias='default'):
+        super(SoftDeleteManager, self).__init__()
+        self.cache_timeout = cache_timeout
+        self.cache_alias = cache_alias
+
+    def contribute_to_class(self, model, name):
+        super(SoftDeleteManager, self).contribute_to_class(model, name)
+        if self.cache_timeout and not model._meta.abstract:
+            connect_invalidation(model)
 
     def get_queryset(self):
-        queryset = SoftDeleteQuerySet(self.model, using=self._db)
-        return queryset.active()
+        queryset = self._queryset_class(self.model, using=self._db)
+        return self._active_through(queryset.active())
+
+    def _active_through(self, queryset):
+        """
+        Many to many related managers, which subclass this manager, also leave
+        out rows linked by a deleted through model row. The filter is sticky so
+        the related manager's own filter, applied next, reuses its join of the
+        through table, keeping one join and one query whether prefetched or not.
+        """
+        through = getattr(self, 'through', None)
+        if through is None or not is_soft_delete_model(through):
+            return queryset
+        related_query_name = through._meta.get_field(self.target_field_name).related_query_name()
+        return queryset._next_is_sticky().filter(**{'%s__deleted' % related_query_name: False})
 
     def deleted(self):
-        queryset = SoftDeleteQuerySet(self.model, using=self._db)
+        queryset = self._queryset_class(self.model, using=self._db)
         return queryset.deleted()
 
     def all_with_deleted(self):
-        queryset = SoftDeleteQuerySet(self.model, using=self._db)
+        queryset = self._queryset_class(self.model, using=self._db)
         return queryset
 
     def all_including_by_pk(self, pk=None):
@@ -36,10 +237,101 @@ class SoftDeleteManager(models.Manager):
             return self.all_with_deleted().filter(Q(deleted=False) | Q(pk=pk))
         return self.get_queryset()
 
+    def all_including_pks(self, pks, field_name='pk'):
+        """
+        Returns the active rows and the rows with any of ``pks``, deleted or
+        not, such as the choices of many forms each with a row selected. Pass
+        ``field_name`` to match the values of another unique field instead,
+        such as the ``to_field`` of a foreign key.
+        """
+        if pks:
+            return self.all_with_deleted().filter(Q(deleted=False) | Q(**{'%s__in' % field_name: pks}))
+        return self.get_queryset()
+
     def all(self):
         return self.get_queryset()
 
+    def using(self, alias):
+        queryset = self.get_queryset().using(alias)
+        # related managers filter on their instance, which must be kept
+        if not hasattr(self, 'instance'):
+            queryset._soft_delete_default = True
+        return queryset
+
     def get(self, allow_deleted=False, *args, **kwargs):
+        # related managers subclass this one, and filter on their instance
+        if self.cache_timeout and not args and list(kwargs) == ['pk'] and not hasattr(self, 'instance'):
+            return cached_get(self, kwargs['pk'])
         if allow_deleted or 'pk' in kwargs:
             return self.all_with_deleted().get(*args, **kwargs)
         return self.get_queryset().get(*args, **kwargs)
+
+    def stats(self, counters=False):
+        """
+        Returns the ``active``, ``deleted`` and ``total`` rows of the model in
+        one query, or with ``counters`` read from the model's counter, for
+        models with ``soft_delete_counters``.
+        """
+        if not counters:
+            return self.all_with_deleted().stats()
+        if not counts_rows(self.model):
+            raise ValueError('%s does not keep counters.' % self.model._meta.label)
+        return read_counters(self.model, self._db or router.db_for_write(self.model))
+
+    def refresh_counters(self):
+        """
+        Recounts the rows of the model into its counter, after writes that
+        bypass it such as ``bulk_create()``.
+        """
+        if not counts_rows(self.model):
+            raise ValueError('%s does not keep counters.' % self.model._meta.label)
+        return refresh_counters(self.model, self._db or router.db_for_write(self.model))
+
+    def restore_batch(self, deletion_batch):
+        """
+        Restores every row soft deleted with ``deletion_batch`` across all
+        models that track deletions, with one update per model and batch of
+        rows. Raises ``ValidationError`` without restoring anything if a
+        restored row would clash with the unique values of another row.
+        """
+        using = self._db or router.db_for_write(self.model)
+        with transaction.atomic(using=using):
+            counts = restore_batch(deletion_batch, using=self._db)
+        invalidate_rows(counts, using)
+        return sum(counts.values()), dict(counts)
+
+    def purge(self, older_than=None, chunk_size=None, sleep=0, lock_timeout=None, dry_run=False):
+        """
+        Physically deletes the soft deleted rows of the model, and first the
+        soft deleted rows of other models whose relation to them cascades, in
+        primary key ordered chunks of ``chunk_size`` each in its own
+        transaction. Rows still referenced by rows that are not purged are kept.
+
+        ``older_than`` is a timedelta limiting the purge to rows deleted before
+        then, dependent rows included, for models that track deletions. ``sleep`` is the pause in seconds
+        between chunks and ``lock_timeout`` the seconds to wait for locks, on
+        PostgreSQL. With ``dry_run`` nothing is deleted.
+
+        Returns the number of rows purged, or that would be, by model label.
+        """
+        queryset = self.deleted()
+        deleted_before = None
+        if older_than is not None:
+            if not tracks_deletions(self.model):
+                raise ValueError('%s does not record when rows are deleted.' % self.model._meta.label)
+            deleted_before = timezone.now() - older_than
+            queryset = queryset.filter(deleted_at__lt=deleted_before)
+        purger = SoftDeletePurger(
+            self._db or router.db_for_write(self.model), chunk_size, sleep, lock_timeout, dry_run, deleted_before)
+        return dict(purger.purge(queryset))
+
+    def validate_unique_bulk(self, objs, batch_size=500):
+        """
+        Validates the unique fields of many objects against all rows in the
+        database, deleted or not, and against each other, with one query per
+        unique check and batch of objects rather than per object.
+
+        Returns a dict of the errors of each invalid object keyed by its
+        position in ``objs``.
+        """
+        return dict(bulk_unique_errors(objs, batch_size))
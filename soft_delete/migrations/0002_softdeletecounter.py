@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 02:47
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('soft_delete', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SoftDeleteCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=255, unique=True)),
+                ('active', models.BigIntegerField(default=0)),
+                ('deleted', models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -1,8 +1,20 @@
+import operator
+import uuid
+from collections import OrderedDict
+from functools import reduce
+
+import django
 from django.core.exceptions import NON_FIELD_ERRORS
-from django.db import models
+from django.db import connections, models, router
+from django.db.models import Case, IntegerField, Max, Q, Value, When
 
-from .manager import SoftDeleteManager
-from .utils import related_objects
+from .cache import invalidate
+from .constraints import active_unique_checks
+from .counters import count_deleted
+from .instrumentation import SoftDeleteOperation, check_cascade_rows, get_max_cascade_rows
+from .manager import SoftDeleteManager, SoftDeleteQuerySet
+from .triggers import cascade_models, trigger_cascade
+from .utils import SoftDeleteCollector, cascade_objects, deletion_values, restore_values
 
 
 class SoftDeleteAbstract(models.Model):
@@ -13,44 +25,149 @@ class SoftDeleteAbstract(models.Model):
 
     objects = SoftDeleteManager()
 
-    def delete(self, **kwargs):
-        self.deleted = True
-        for object in related_objects(self):
-            object.delete()
-        super(SoftDeleteAbstract, self).save(**kwargs)
+    # set once the triggers of soft_delete.triggers are installed for the model
+    soft_delete_triggers = False
+    # keep a SoftDeleteCounter of the model's rows, see soft_delete.counters
+    soft_delete_counters = False
+
+    def delete(self, deletion_batch=None, max_cascade_rows=None, deferred=False, **kwargs):
+        """
+        Soft deletes the object and its cascade. Only the deletion fields are
+        written, with ``save(update_fields=...)``, so ``pre_save`` and
+        ``post_save`` are sent with those ``update_fields``, alongside
+        ``pre_soft_delete`` and ``post_soft_delete``. ``pre_delete`` and
+        ``post_delete`` are only sent for hard deleted related objects.
+        """
+        if self.deleted and not self._state.adding:
+            # rows already deleted keep the batch they were deleted with
+            return
+        using = kwargs.get('using') or router.db_for_write(self.__class__, instance=self)
+        if deferred:
+            # flag this row now and queue the cascade, see soft_delete.deferred
+            deletion_batch = deletion_batch or uuid.uuid4()
+            queryset = SoftDeleteQuerySet(self.__class__, using=using).filter(pk=self.pk)
+            result = queryset.delete(deletion_batch=deletion_batch, max_cascade_rows=max_cascade_rows, deferred=True)
+            for field_name, value in deletion_values(self.__class__, deletion_batch).items():
+                setattr(self, field_name, value)
+            return result
+
+        with SoftDeleteOperation(self.__class__, using, deletion_batch) as operation:
+            max_cascade_rows = get_max_cascade_rows(max_cascade_rows)
+            if not operation.nested and max_cascade_rows is not None:
+                queryset = SoftDeleteQuerySet(self.__class__, using=using).filter(pk=self.pk)
+                rows = SoftDeleteCollector(using).count(queryset)
+                rows[self._meta.label] = max(rows[self._meta.label], 1)
+                check_cascade_rows(self.__class__, rows, max_cascade_rows)
+
+            operation.visit(self)
+            adding = self._state.adding
+            values = deletion_values(self.__class__, operation.get_deletion_batch())
+            for field_name, value in values.items():
+                setattr(self, field_name, value)
+            triggered, complete = trigger_cascade(self.__class__, connections[using])
+            if not complete:
+                for object in cascade_objects(self):
+                    # rows in a cycle are read again before they are saved
+                    if not operation.visit(object):
+                        continue
+                    if isinstance(object, SoftDeleteAbstract):
+                        # the object's delete shares this operation's batch
+                        object.delete()
+                    else:
+                        operation.add(object.delete()[1])
+            if adding:
+                super(SoftDeleteAbstract, self).save(**kwargs)
+            else:
+                # leave other fields alone, they may have been changed since
+                super(SoftDeleteAbstract, self).save(update_fields=list(values), **kwargs)
+            operation.add({self._meta.label: 1})
+            if not adding:
+                # an unsaved row is counted as deleted when it is created
+                count_deleted(self.__class__, using, 1)
+            if complete:
+                # the database cascaded the delete, drop what the cache holds
+                for model in cascade_models(self.__class__)[0]:
+                    invalidate(model, using)
+
+    def delete_preview(self, sample_size=0):
+        """
+        Returns ``(total, counts, samples)`` for a soft delete of this object,
+        see ``SoftDeleteQuerySet.delete_preview()``.
+        """
+        using = router.db_for_write(self.__class__, instance=self)
+        queryset = SoftDeleteQuerySet(self.__class__, using=using).filter(pk=self.pk)
+        return queryset.delete_preview(sample_size)
+
+    def restore(self, cascade=True):
+        using = router.db_for_write(self.__class__, instance=self)
+        queryset = SoftDeleteQuerySet(self.__class__, using=using).filter(pk=self.pk)
+        result = queryset.restore(cascade=cascade)
+        if result[0]:
+            for field_name, value in restore_values(self.__class__).items():
+                setattr(self, field_name, value)
+        return result
+    restore.alters_data = True
+
+    def _get_unique_checks(self, *args, **kwargs):
+        unique_checks, date_checks = super(SoftDeleteAbstract, self)._get_unique_checks(*args, **kwargs)
+        # django validates conditional constraints itself from 4.1
+        if django.VERSION < (4, 1):
+            exclude = kwargs.get('exclude', args[0] if args else None) or ()
+            for model_class, unique_check in active_unique_checks(self.__class__):
+                if not any(name in exclude for name in unique_check):
+                    unique_checks.append((model_class, unique_check))
+        return unique_checks, date_checks
+
+    def _unique_lookup(self, unique_check):
+        # Try to look up an existing object with the same values as this
+        # object's values for all the unique field.
+
+        lookup_kwargs = {}
+        for field_name in unique_check:
+            f = self._meta.get_field(field_name)
+            lookup_value = getattr(self, f.attname)
+            if lookup_value is None:
+                # no value, skip the lookup
+                continue
+            if f.primary_key and not self._state.adding:
+                # no need to check for unique primary key when editing
+                continue
+            lookup_kwargs[str(field_name)] = lookup_value
+
+        # some fields were skipped, no reason to do the check
+        if len(unique_check) != len(lookup_kwargs):
+            return None
+        return lookup_kwargs
 
     def _perform_unique_checks(self, unique_checks):
         errors = {}
+        active_checks = active_unique_checks(self.__class__)
+        lookups = OrderedDict()
 
         for model_class, unique_check in unique_checks:
-            # Try to look up an existing object with the same values as this
-            # object's values for all the unique field.
-
-            lookup_kwargs = {}
-            for field_name in unique_check:
-                f = self._meta.get_field(field_name)
-                lookup_value = getattr(self, f.attname)
-                if lookup_value is None:
-                    # no value, skip the lookup
-                    continue
-                if f.primary_key and not self._state.adding:
-                    # no need to check for unique primary key when editing
-                    continue
-                lookup_kwargs[str(field_name)] = lookup_value
-
-            # some fields were skipped, no reason to do the check
-            if len(unique_check) != len(lookup_kwargs):
+            lookup_kwargs = self._unique_lookup(unique_check)
+            if lookup_kwargs is None:
                 continue
 
             """
             Addition:
-            This is the only changed section from the original code
-            and is to ensure that when unique checks are made we have all records including deleted
-            as these do not appear in the default queryset
+            This is to ensure that when unique checks are made we have all records including deleted
+            as these do not appear in the default queryset, unless the check comes from a unique
+            constraint on active rows only
             """
-            qs = model_class._default_manager.all_with_deleted().filter(**lookup_kwargs)
+            condition = Q(**lookup_kwargs)
+            if (model_class, tuple(unique_check)) in active_checks:
+                condition &= Q(deleted=False)
+            lookups.setdefault(model_class, []).append((unique_check, condition))
             # end change
 
+        """
+        Addition:
+        The checks for each model class are made in one query, flagging which of the checks matched
+        """
+        for model_class, checks in lookups.items():
+            qs = model_class._default_manager.all_with_deleted()
+
             # Exclude the current object from the query if we are editing an
             # instance (as opposed to creating a new one)
             # Note that we need to use the pk as defined by model_class, not
@@ -60,11 +177,76 @@ class SoftDeleteAbstract(models.Model):
             model_class_pk = self._get_pk_val(model_class._meta)
             if not self._state.adding and model_class_pk is not None:
                 qs = qs.exclude(pk=model_class_pk)
-            if qs.exists():
-                if len(unique_check) == 1:
-                    key = unique_check[0]
-                else:
-                    key = NON_FIELD_ERRORS
-                errors.setdefault(key, []).append(self.unique_error_message(model_class, unique_check))
+            matches = qs.filter(reduce(operator.or_, [condition for unique_check, condition in checks])).aggregate(**{
+                'check_%d' % i: Max(Case(When(condition, then=Value(1)), default=Value(0), output_field=IntegerField()))
+                for i, (unique_check, condition) in enumerate(checks)
+            })
+            for i, (unique_check, condition) in enumerate(checks):
+                if matches['check_%d' % i]:
+                    if len(unique_check) == 1:
+                        key = unique_check[0]
+                    else:
+                        key = NON_FIELD_ERRORS
+                    errors.setdefault(key, []).append(self.unique_error_message(model_class, unique_check))
 
         return errors
+
+
+class SoftDeleteTrackedAbstract(SoftDeleteAbstract):
+    """
+    Records when a row was soft deleted and the batch id of the delete that
+    flagged it, shared by every row of the same cascade.
+    """
+    deleted_at = models.DateTimeField(null=True, editable=False)
+    deletion_batch = models.UUIDField(null=True, editable=False, db_index=True)
+
+    class Meta:
+        abstract = True
+
+
+class SoftDeleteJob(models.Model):
+    """
+    A soft delete whose cascade is deferred to a worker, see
+    ``soft_delete.deferred``. The rows to cascade from are queued as
+    ``SoftDeleteJobBatch`` rows until the job is finished.
+    """
+    model = models.CharField(max_length=255)
+    using = models.CharField(max_length=255)
+    deletion_batch = models.UUIDField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True)
+    rows = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ('pk',)
+
+    def __str__(self):
+        return '%s %s' % (self.model, self.deletion_batch)
+
+    @property
+    def finished(self):
+        return self.finished_at is not None
+
+
+class SoftDeleteJobBatch(models.Model):
+    """
+    Primary keys of soft deleted rows whose cascade is still to be run.
+    """
+    job = models.ForeignKey(SoftDeleteJob, related_name='batches', on_delete=models.CASCADE)
+    model = models.CharField(max_length=255)
+    pks = models.TextField()
+
+    class Meta:
+        ordering = ('pk',)
+
+
+class SoftDeleteCounter(models.Model):
+    """
+    The active and deleted rows of a model, see ``soft_delete.counters``.
+    """
+    model = models.CharField(max_length=255, unique=True)
+    active = models.BigIntegerField(default=0)
+    deleted = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return self.model
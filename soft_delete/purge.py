@@ -0,0 +1,96 @@
+import time
+from collections import Counter, defaultdict
+
+from django.db import connections, transaction
+
+from .utils import cascade_plan, tracks_deletions
+
+
+class SoftDeletePurger(object):
+    """
+    Physically deletes soft deleted rows in primary key ordered chunks, each in
+    its own short transaction.
+
+    Soft deleted rows of other models whose relation to a chunk cascades are
+    purged first, so rows go in dependency order, with ``deleted_before`` only
+    those deleted before then. Rows still referenced by a row that is not
+    purged, or would not be deleted along with them, are kept.
+    """
+
+    chunk_size = 1000
+
+    def __init__(self, using, chunk_size=None, sleep=0, lock_timeout=None, dry_run=False, deleted_before=None):
+        self.using = using
+        if chunk_size is not None:
+            self.chunk_size = chunk_size
+        self.sleep = sleep
+        self.lock_timeout = lock_timeout
+        self.dry_run = dry_run
+        self.deleted_before = deleted_before
+        self.counts = Counter()
+
+    def set_lock_timeout(self):
+        connection = connections[self.using]
+        if self.lock_timeout is not None and connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL lock_timeout = %s', ['%dms' % (self.lock_timeout * 1000)])
+
+    def purge(self, queryset):
+        """
+        Purges the deleted rows of the queryset, returning a counter of the rows
+        purged, or that would be with ``dry_run``, keyed by model label.
+        """
+        queryset = queryset.filter(deleted=True).order_by('pk')
+        last_pk = None
+        while True:
+            chunk_qs = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            pks = list(chunk_qs.values_list('pk', flat=True)[:self.chunk_size])
+            if not pks:
+                break
+            last_pk = pks[-1]
+            with transaction.atomic(using=self.using):
+                self.set_lock_timeout()
+                self.purge_pks(queryset.model, pks)
+            if self.sleep and len(pks) == self.chunk_size:
+                time.sleep(self.sleep)
+        return self.counts
+
+    def purge_pks(self, model, pks):
+        """
+        Purges the rows of the model after their soft deleted dependents,
+        returning the primary keys of the rows purged.
+        """
+        purged = defaultdict(set)
+        for relation in cascade_plan(model):
+            if relation.cascades and relation.soft_delete:
+                dependents = relation.queryset(pks, self.using).filter(deleted=True)
+                if self.deleted_before is not None:
+                    if not tracks_deletions(relation.model):
+                        # no telling when these were deleted, they keep their rows
+                        continue
+                    dependents = dependents.filter(deleted_at__lt=self.deleted_before)
+                if relation.model is model:
+                    dependents = dependents.exclude(pk__in=pks)
+                dependents = list(dependents.values_list('pk', flat=True))
+                for start in range(0, len(dependents), self.chunk_size):
+                    chunk = dependents[start:start + self.chunk_size]
+                    purged[relation.model].update(self.purge_pks(relation.model, chunk))
+
+        referenced = set()
+        for relation in cascade_plan(model):
+            if relation.cascades and not relation.soft_delete:
+                # deleted along with the rows
+                continue
+            for pk, reference in relation.queryset(pks, self.using).values_list('pk', relation.attname):
+                if pk not in purged[relation.model]:
+                    referenced.add(reference)
+        pks = [pk for pk in pks if pk not in referenced]
+        if not pks:
+            return pks
+
+        if self.dry_run:
+            self.counts[model._meta.label] += len(pks)
+        else:
+            deleted, counts = model._base_manager.using(self.using).filter(pk__in=pks).delete()
+            self.counts.update({label: count for label, count in counts.items() if count})
+        return pks
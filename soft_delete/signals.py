@@ -0,0 +1,16 @@
+from django.dispatch import Signal
+
+# Sent before a soft delete issues any updates.
+# sender: the model being deleted, using: the database alias.
+pre_soft_delete = Signal()
+
+# Sent after each level of a bulk soft delete cascade is flagged.
+# sender: the model being deleted, level: the depth of the level from 0,
+# rows: the rows affected by model label, elapsed: seconds, using.
+soft_delete_level = Signal()
+
+# Sent after a soft delete and its cascade are complete.
+# sender: the model being deleted, rows: the rows affected by model label,
+# queries: the number of queries run or None where django cannot count them,
+# elapsed: seconds, using.
+post_soft_delete = Signal()
@@ -0,0 +1,180 @@
+"""
+Database triggers cascading soft deletes, on PostgreSQL and SQLite.
+
+When the ``deleted`` flag of a row flips to true its trigger flags the active
+rows of the soft delete models its foreign keys cascade to, copying
+``deleted_at`` and ``deletion_batch`` where both models track deletions.
+Install the triggers of each model with a cascade using the
+``InstallSoftDeleteTriggers`` migration operation, and set
+``soft_delete_triggers = True`` on the model. Once every model of a cascade has
+its triggers a soft delete is a single update of the rows deleted, otherwise,
+and on other databases, the cascade is followed in python.
+"""
+from django.db import models, router
+from django.db.backends.utils import truncate_name
+from django.db.migrations.operations.base import Operation
+from django.db.models.deletion import get_candidate_relations_to_delete
+
+from .counters import counts_rows
+from .utils import CascadeRelation, cascade_plan
+
+TRIGGER_VENDORS = ('postgresql', 'sqlite')
+
+
+def field_names(model):
+    return set(field.name for field in model._meta.concrete_fields)
+
+
+def trigger_relations(model):
+    """
+    Returns the foreign keys of soft delete models a soft delete of the model
+    cascades to. Works with the models of migration states, which do not keep
+    their abstract bases, so soft delete models are told apart by their fields.
+
+    Cascades to other models, such as the through table of a plain many to
+    many field, are left to the python cascade, see ``cascade_models()``.
+    """
+    return [
+        related.field for related in get_candidate_relations_to_delete(model._meta)
+        if related.on_delete is models.CASCADE and 'deleted' in field_names(related.related_model)
+    ]
+
+
+def trigger_fingerprint(model):
+    """
+    Returns the relations followed by the trigger of the model, to tell
+    whether an installed trigger is out of date.
+    """
+    return sorted((field.model._meta.label_lower, field.name) for field in trigger_relations(model))
+
+
+def trigger_name(model, connection):
+    return truncate_name('soft_delete_%s' % model._meta.db_table, connection.ops.max_name_length())
+
+
+def create_trigger_sql(model, connection):
+    """
+    Returns the statements creating the trigger of the model, none if the
+    database is not supported or deletes of the model do not cascade.
+    """
+    if connection.vendor not in TRIGGER_VENDORS:
+        return []
+    qn = connection.ops.quote_name
+    true = '1' if connection.vendor == 'sqlite' else 'true'
+    tracked = {'deleted_at', 'deletion_batch'}
+    updates = []
+    for field in trigger_relations(model):
+        related = field.model
+        if connection.vendor == 'sqlite' and related._meta.db_table == model._meta.db_table:
+            raise ValueError('%s cascades to itself, which SQLite triggers cannot follow.' % model._meta.label)
+        deleted = qn(related._meta.get_field('deleted').column)
+        assignments = ['%s = %s' % (deleted, true)]
+        if tracked <= field_names(model) and tracked <= field_names(related):
+            assignments.extend(
+                '%s = NEW.%s' % (qn(related._meta.get_field(name).column), qn(model._meta.get_field(name).column))
+                for name in sorted(tracked))
+        updates.append('UPDATE %s SET %s WHERE %s = NEW.%s AND NOT %s;' % (
+            qn(related._meta.db_table), ', '.join(assignments), qn(field.column),
+            qn(field.target_field.column), deleted))
+    if not updates:
+        return []
+
+    name = qn(trigger_name(model, connection))
+    deleted = qn(model._meta.get_field('deleted').column)
+    condition = 'NEW.%s AND NOT OLD.%s' % (deleted, deleted)
+    table = qn(model._meta.db_table)
+    if connection.vendor == 'sqlite':
+        return ['CREATE TRIGGER %s AFTER UPDATE OF %s ON %s FOR EACH ROW WHEN %s BEGIN %s END' % (
+            name, deleted, table, condition, ' '.join(updates))]
+    return [
+        'CREATE FUNCTION %s() RETURNS trigger AS $$ BEGIN %s RETURN NULL; END; $$ LANGUAGE plpgsql' % (
+            name, ' '.join(updates)),
+        'CREATE TRIGGER %s AFTER UPDATE OF %s ON %s FOR EACH ROW WHEN (%s) EXECUTE PROCEDURE %s()' % (
+            name, deleted, table, condition, name),
+    ]
+
+
+def drop_trigger_sql(model, connection):
+    if connection.vendor not in TRIGGER_VENDORS:
+        return []
+    qn = connection.ops.quote_name
+    name = qn(trigger_name(model, connection))
+    if connection.vendor == 'sqlite':
+        return ['DROP TRIGGER IF EXISTS %s' % name]
+    return [
+        'DROP TRIGGER IF EXISTS %s ON %s' % (name, qn(model._meta.db_table)),
+        'DROP FUNCTION IF EXISTS %s()' % name,
+    ]
+
+
+def cascade_models(model):
+    """
+    Returns the models a soft delete of the model cascades to, itself
+    included, and whether triggers can follow every relation of the cascade.
+    """
+    found = [model]
+    followable = True
+    for current in found:
+        relations = [relation for relation in cascade_plan(current) if relation.cascades]
+        if relations and not getattr(current, 'soft_delete_triggers', False):
+            followable = False
+        for relation in relations:
+            if not isinstance(relation, CascadeRelation) or not relation.soft_delete:
+                followable = False
+            elif relation.model not in found:
+                found.append(relation.model)
+    return found, followable
+
+
+def trigger_cascade(model, connection):
+    """
+    Returns ``(triggered, complete)``: whether any model of the cascade of a
+    soft delete of the model has triggers on the database, and whether the
+    triggers follow the whole cascade, leaving nothing to do in python.
+    Triggers cannot span databases, so a cascade to models routed to another
+    database than the model is never complete.
+    """
+    if connection.vendor not in TRIGGER_VENDORS:
+        return False, False
+    found, followable = cascade_models(model)
+    triggered = any(getattr(related, 'soft_delete_triggers', False) for related in found)
+    # rows flagged by a trigger would be missing from counted models' counters
+    counted = any(counts_rows(related) for related in found[1:])
+    alias = router.db_for_write(model)
+    routed = all(router.db_for_write(related) == alias for related in found[1:])
+    return triggered, triggered and followable and not counted and routed
+
+
+class InstallSoftDeleteTriggers(Operation):
+    """
+    Creates, or recreates, the soft delete trigger of a model. Add it again
+    when a model gains relations its deletes cascade to.
+    """
+    reduces_to_sql = True
+    reversible = True
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def deconstruct(self):
+        return self.__class__.__name__, [self.model_name], {}
+
+    def state_forwards(self, app_label, state):
+        pass
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            for sql in drop_trigger_sql(model, schema_editor.connection):
+                schema_editor.execute(sql)
+            for sql in create_trigger_sql(model, schema_editor.connection):
+                schema_editor.execute(sql)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            for sql in drop_trigger_sql(model, schema_editor.connection):
+                schema_editor.execute(sql)
+
+    def describe(self):
+        return 'Install soft delete triggers on %s' % self.model_name
@@ -1,17 +1,654 @@
-import itertools
+import operator
+import time
+import uuid
+from collections import Counter, defaultdict
+from functools import reduce
 
-from django.contrib.admin.utils import NestedObjects
-from django.db import router
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import NON_FIELD_ERRORS, ValidationError
+from django.core.signals import setting_changed
+from django.db import connections, models, router, transaction
+from django.db.models import Count, Exists, OuterRef, Q
+from django.db.models.deletion import get_candidate_relations_to_delete
+from django.db.models.signals import class_prepared
+from django.utils import timezone
+
+from .cache import invalidate
+from .counters import count_deleted, count_restored
+from .signals import soft_delete_level
+
+
+def is_soft_delete_model(model):
+    from .models import SoftDeleteAbstract
+    return issubclass(model, SoftDeleteAbstract)
+
+
+def tracks_deletions(model):
+    from .models import SoftDeleteTrackedAbstract
+    return issubclass(model, SoftDeleteTrackedAbstract)
+
+
+def deletion_values(model, deletion_batch, deleted_at=None):
+    """
+    Returns the field values to set when soft deleting rows of the model.
+    """
+    values = {'deleted': True}
+    if tracks_deletions(model):
+        values['deleted_at'] = deleted_at or timezone.now()
+        values['deletion_batch'] = deletion_batch
+    return values
+
+
+def restore_values(model):
+    """
+    Returns the field values to set when restoring rows of the model.
+    """
+    values = {'deleted': False}
+    if tracks_deletions(model):
+        values['deleted_at'] = None
+        values['deletion_batch'] = None
+    return values
+
+
+class CascadeRelation(object):
+    """
+    A reverse foreign key or one to one relation that may need following
+    when an object of the related model is deleted.
+    """
+
+    def __init__(self, field):
+        self.field = field
+        self.model = field.model
+        self.soft_delete = is_soft_delete_model(self.model)
+        # the column of the related model holding the deleted object's pk
+        self.attname = field.attname
+
+    def __repr__(self):
+        return '<%s: %s.%s>' % (self.__class__.__name__, self.model._meta.label, self.field.name)
+
+    @property
+    def cascades(self):
+        # on_delete is read each time as it can be changed at runtime
+        return self.field.remote_field.on_delete is models.CASCADE
+
+    def queryset(self, pks, using):
+        return self.model._base_manager.using(using).filter(**{'%s__in' % self.field.name: pks})
+
+
+class GenericCascadeRelation(object):
+    """
+    A generic relation, the related objects are always deleted along with
+    the object that holds the relation.
+    """
+
+    cascades = True
+
+    def __init__(self, field):
+        self.field = field
+        self.model = field.remote_field.model
+        self.soft_delete = is_soft_delete_model(self.model)
+        self.attname = field.object_id_field_name
+
+    def __repr__(self):
+        return '<%s: %s.%s>' % (self.__class__.__name__, self.field.model._meta.label, self.field.name)
+
+    def queryset(self, pks, using):
+        from django.contrib.contenttypes.models import ContentType
+        content_type = ContentType.objects.db_manager(using).get_for_model(
+            self.field.model, for_concrete_model=self.field.for_concrete_model)
+        return self.model._base_manager.using(using).filter(**{
+            '%s__pk' % self.field.content_type_field_name: content_type.pk,
+            '%s__in' % self.field.object_id_field_name: pks,
+        })
+
+
+_cascade_plans = {}
+
+
+def cascade_plan(model):
+    """
+    Returns the relations to consider when an object of the model is deleted.
+
+    The relation graph of a model does not change once the app registry is
+    ready so the plan is built once per model and memoized.
+    """
+    try:
+        return _cascade_plans[model]
+    except KeyError:
+        pass
+    plan = [CascadeRelation(related.field) for related in get_candidate_relations_to_delete(model._meta)]
+    plan.extend(
+        GenericCascadeRelation(field) for field in model._meta.private_fields
+        if hasattr(field, 'bulk_related_objects')
+    )
+    _cascade_plans[model] = plan = tuple(plan)
+    return plan
+
+
+def clear_cascade_plans(**kwargs):
+    _cascade_plans.clear()
+
+
+class_prepared.connect(clear_cascade_plans)
+setting_changed.connect(clear_cascade_plans)
+
+
+def cascade_objects(obj):
+    """
+    Returns the objects directly cascaded to when the object is deleted.
+    """
+    for relation in cascade_plan(obj.__class__):
+        if relation.cascades:
+            using = router.db_for_write(relation.model, instance=obj)
+            for related in relation.queryset([obj.pk], using):
+                yield related
 
 
 def related_objects(obj):
-    collector = NestedObjects(using=router.db_for_write(obj))
-    collector.collect([obj])
-
-    def flatten(elem):
-        if isinstance(elem, list):
-            return itertools.chain.from_iterable(map(flatten, elem))
-        elif obj != elem:
-            return (elem,)
-        return ()
-    return flatten(collector.nested())
+    """
+    Returns every object cascaded to when the object is deleted, each object
+    before the objects that depend on it.
+    """
+    seen = {(obj.__class__, obj.pk)}
+
+    def collect(parent):
+        for related in cascade_objects(parent):
+            key = (related.__class__, related.pk)
+            if key not in seen:
+                seen.add(key)
+                yield related
+                for descendant in collect(related):
+                    yield descendant
+    return collect(obj)
+
+
+class DatabaseTransaction(object):
+    """
+    A transaction on a database other than the one a soft delete or restore
+    started on, kept open until the whole operation is done. When threaded
+    its queries run in a thread of its own, so that databases are updated at
+    the same time.
+    """
+
+    def __init__(self, alias, threaded=False):
+        self.alias = alias
+        self.atomic = transaction.atomic(using=alias)
+        self.executor = None
+        if threaded:
+            from concurrent.futures import ThreadPoolExecutor
+            self.executor = ThreadPoolExecutor(max_workers=1)
+        self.submit(self.atomic.__enter__)()
+
+    def submit(self, func, *args):
+        """
+        Runs ``func(*args)`` in the transaction, returning a callable that
+        waits for and returns its result.
+        """
+        if self.executor is None:
+            result = func(*args)
+            return lambda: result
+        return self.executor.submit(func, *args).result
+
+    def close(self, exc_type=None, exc_value=None, traceback=None):
+        """
+        Commits the transaction, or rolls it back after an exception.
+        """
+        if self.executor is None:
+            self.atomic.__exit__(exc_type, exc_value, traceback)
+            return
+        try:
+            self.submit(self.atomic.__exit__, exc_type, exc_value, traceback)()
+        finally:
+            self.submit(self.close_connection)()
+            self.executor.shutdown()
+
+    def close_connection(self):
+        # the thread's own connection is of no use once the thread is gone
+        connections[self.alias].close()
+
+
+class SoftDeleteCollector(object):
+    """
+    Collects the cascade of a soft delete breadth first, one level of the
+    relation graph at a time. Only primary keys are fetched, in ``pk__in``
+    batches of at most ``batch_size``, and each primary key is collected once
+    per model, so memory stays flat however many rows the cascade touches.
+
+    Rows of models routed to the same database as the model deleted are read
+    and written with ``using``, those of models routed elsewhere, such as
+    another shard, with the database they are routed to. Writes to other
+    databases are made in a transaction on each, opened by the first and
+    closed when the collector is used as a context manager is left::
+
+        with collector, transaction.atomic(using=collector.using):
+            collector.delete(queryset)
+
+    so they are committed, or rolled back, after the transaction of ``using``.
+    A cascade across databases is not atomic as a whole, a failure to commit
+    one database leaves the others committed. With ``concurrent``, or the
+    ``SOFT_DELETE_CONCURRENT_DATABASES`` setting, the other databases are
+    written to at the same time, each from a thread of its own, except those
+    the calling thread is already in a transaction on, whose rows and locks
+    another connection could not share.
+    """
+
+    batch_size = 500
+
+    def __init__(self, using, batch_size=None, deletion_batch=None, concurrent=None):
+        self.using = using
+        if batch_size is not None:
+            self.batch_size = batch_size
+        self.deletion_batch = deletion_batch or uuid.uuid4()
+        self.deleted_at = timezone.now()
+        self.seen = defaultdict(set)
+        self.model = None
+        self.aliases = {}
+        if concurrent is None:
+            concurrent = getattr(settings, 'SOFT_DELETE_CONCURRENT_DATABASES', False)
+        self.concurrent = concurrent
+        self.transactions = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        transactions, self.transactions = self.transactions, {}
+        for database_transaction in transactions.values():
+            database_transaction.close(exc_type, exc_value, traceback)
+
+    def db_for(self, model):
+        """
+        Returns the database alias holding the rows of the model.
+        """
+        try:
+            return self.aliases[model]
+        except KeyError:
+            pass
+        alias = router.db_for_write(model)
+        if self.model is None or alias == router.db_for_write(self.model):
+            alias = self.using
+        self.aliases[model] = alias
+        return alias
+
+    def transaction_for(self, alias):
+        try:
+            return self.transactions[alias]
+        except KeyError:
+            pass
+        threaded = self.concurrent and not connections[alias].in_atomic_block
+        self.transactions[alias] = database_transaction = DatabaseTransaction(alias, threaded)
+        return database_transaction
+
+    def by_alias(self, level, func):
+        """
+        Runs ``func(alias, batches)`` for the ``(model, pks)`` batches of each
+        database of a level, summing the counters returned. ``using`` is run
+        in the current transaction, other databases in their own, see the
+        class docstring.
+        """
+        batches = defaultdict(list)
+        for model, pks in level:
+            batches[self.db_for(model)].append((model, pks))
+        results = [
+            self.transaction_for(alias).submit(func, alias, alias_batches)
+            for alias, alias_batches in batches.items() if alias != self.using]
+        counts = Counter(func(self.using, batches[self.using]) if self.using in batches else {})
+        for result in results:
+            counts.update(result())
+        return counts
+
+    def batches(self, model, pks):
+        """
+        Yields ``(model, pks)`` batches of the primary keys not yet collected.
+        """
+        seen = self.seen[model]
+        batch = []
+        for pk in pks:
+            if pk not in seen:
+                seen.add(pk)
+                batch.append(pk)
+                if len(batch) == self.batch_size:
+                    yield model, batch
+                    batch = []
+        if batch:
+            yield model, batch
+
+    def collect(self, queryset, deleted=False, deletion_batches=None):
+        """
+        Yields each level of the cascade as a list of ``(model, pks)`` batches,
+        the first level being the active rows of the queryset. Models that are
+        not soft deletable are collected but not followed, their own delete
+        handles the rest of their cascade.
+
+        With ``deleted=True`` the rows already deleted are collected instead,
+        for a restore, and models that are not soft deletable are skipped. Soft
+        deleted rows of models that track deletions are then only followed when
+        their ``deletion_batch`` is one of ``deletion_batches``, if given.
+        """
+        if self.model is None:
+            self.model = queryset.model
+        pks = queryset.filter(deleted=deleted).values_list('pk', flat=True).iterator()
+        level = list(self.batches(queryset.model, pks))
+        while level:
+            yield level
+            level = list(self.children(level, deleted, deletion_batches))
+
+    def children(self, level, deleted=False, deletion_batches=None):
+        """
+        Yields the ``(model, pks)`` batches of the next level of the cascade.
+        """
+        for model, pks in level:
+            if not is_soft_delete_model(model):
+                continue
+            for relation in cascade_plan(model):
+                if not relation.cascades or (deleted and not relation.soft_delete):
+                    continue
+                related_qs = relation.queryset(pks, self.db_for(relation.model))
+                if relation.soft_delete:
+                    related_qs = related_qs.filter(deleted=deleted)
+                    if deletion_batches is not None and tracks_deletions(relation.model):
+                        related_qs = related_qs.filter(deletion_batch__in=deletion_batches)
+                for batch in self.batches(relation.model, related_qs.values_list('pk', flat=True).iterator()):
+                    yield batch
+
+    def count(self, queryset):
+        """
+        Returns a counter of the rows a delete of the queryset would affect
+        keyed by model label, without changing anything.
+        """
+        counts = Counter()
+        for level in self.collect(queryset):
+            for model, pks in level:
+                counts[model._meta.label] += len(pks)
+        return counts
+
+    def preview(self, queryset, sample_size=0):
+        """
+        Returns ``(total, counts, samples)`` for a delete of the queryset: the
+        rows it would affect, in total and keyed by model label, and up to
+        ``sample_size`` of the primary keys of each model, without changing
+        anything. Relations are followed as for a delete.
+
+        Rows are counted with one COUNT query per model, whose rows affected
+        are described by a subquery on the rows affected of the models it
+        relates to, so no primary keys are fetched. Cascades through models
+        related to themselves, directly or not, collect primary keys instead.
+        """
+        model = queryset.model
+        order = [model]
+        incoming = defaultdict(list)
+        for current in order:
+            if not is_soft_delete_model(current):
+                continue
+            for relation in cascade_plan(current):
+                if relation.cascades:
+                    incoming[relation.model].append((current, relation))
+                    if relation.model not in order:
+                        order.append(relation.model)
+
+        self.model = model
+        order = self.dependency_order(order, incoming)
+        # subqueries cannot span databases
+        if order is not None and any(self.db_for(related) != self.using for related in order):
+            order = None
+        if order is None:
+            counts, samples = Counter(), defaultdict(list)
+            for level in self.collect(queryset):
+                for related, pks in level:
+                    counts[related._meta.label] += len(pks)
+                    samples[related._meta.label].extend(pks[:sample_size - len(samples[related._meta.label])])
+        else:
+            affected = {model: queryset.filter(deleted=False)}
+            for related in order[1:]:
+                conditions = [
+                    Q(pk__in=relation.queryset(affected[parent].values('pk'), self.using).values('pk'))
+                    for parent, relation in incoming[related]]
+                affected[related] = related._base_manager.using(self.using).filter(reduce(operator.or_, conditions))
+                if is_soft_delete_model(related):
+                    affected[related] = affected[related].filter(deleted=False)
+            counts, samples = Counter(), {}
+            for related in order:
+                rows = affected[related].count()
+                if rows:
+                    counts[related._meta.label] = rows
+                    if sample_size:
+                        pks = affected[related].order_by('pk').values_list('pk', flat=True)[:sample_size]
+                        samples[related._meta.label] = list(pks)
+        samples = dict((label, pks) for label, pks in samples.items() if pks)
+        return sum(counts.values()), dict(counts), samples
+
+    def dependency_order(self, models, incoming):
+        """
+        Orders the models so each comes after the models it relates to,
+        returning None if the relations form a cycle.
+        """
+        order = []
+        remaining = list(models)
+        while remaining:
+            ready = [model for model in remaining if all(parent in order for parent, _ in incoming[model])]
+            if not ready:
+                return None
+            order.extend(ready)
+            remaining = [model for model in remaining if model not in ready]
+        return order
+
+    def delete(self, queryset, max_cascade_rows=None):
+        """
+        Soft deletes the queryset and its cascade with one update per batch,
+        level by level, sending ``soft_delete_level`` after each level. Models
+        that track deletions are stamped with the time and the collector's
+        ``deletion_batch``. Returns a counter of the rows affected keyed by
+        model label.
+
+        With ``max_cascade_rows`` the whole cascade is collected first and
+        ``CascadeLimitExceeded`` raised before any update if it is larger.
+
+        When database triggers follow the whole cascade, see
+        ``soft_delete.triggers``, only the rows of the queryset are updated and
+        counted. When they follow part of it the cascade is collected first, so
+        rows flagged by a trigger are still followed.
+        """
+        from .instrumentation import check_cascade_rows
+        from .triggers import cascade_models, trigger_cascade
+
+        self.model = queryset.model
+        triggered, complete = trigger_cascade(queryset.model, connections[self.using])
+        if complete and max_cascade_rows is None:
+            start = time.time()
+            model = queryset.model
+            values = deletion_values(model, self.deletion_batch, self.deleted_at)
+            counts = Counter({model._meta.label: queryset.filter(deleted=False).update(**values)})
+            count_deleted(model, self.using, counts[model._meta.label])
+            for related in cascade_models(model)[0]:
+                invalidate(related, self.using)
+            soft_delete_level.send(
+                sender=model, level=0, rows=dict(counts), elapsed=time.time() - start, using=self.using)
+            return counts
+
+        levels = self.collect(queryset)
+        if max_cascade_rows is not None or triggered:
+            levels = list(levels)
+        if max_cascade_rows is not None:
+            rows = Counter()
+            for level in levels:
+                for model, pks in level:
+                    rows[model._meta.label] += len(pks)
+            check_cascade_rows(queryset.model, rows, max_cascade_rows)
+
+        counts = Counter()
+        for depth, level in enumerate(levels):
+            start = time.time()
+            level_counts = self.by_alias(level, self.delete_batches)
+            counts.update(level_counts)
+            soft_delete_level.send(
+                sender=queryset.model, level=depth, rows=dict(level_counts), elapsed=time.time() - start,
+                using=self.using)
+        return counts
+
+    def delete_batches(self, using, batches):
+        counts = Counter()
+        for model, pks in batches:
+            batch_qs = model._base_manager.using(using).filter(pk__in=pks)
+            if is_soft_delete_model(model):
+                values = deletion_values(model, self.deletion_batch, self.deleted_at)
+                rows = batch_qs.update(**values)
+                counts[model._meta.label] += rows
+                count_deleted(model, using, rows)
+            else:
+                counts.update(batch_qs.delete()[1])
+        return counts
+
+    def restore(self, queryset, cascade=True):
+        """
+        Restores the deleted rows of the queryset with one update per batch.
+        With ``cascade`` the rows deleted along with them are restored too,
+        for models that track deletions only those deleted in the same batch.
+
+        The whole restore is collected and checked for unique conflicts, with
+        the active rows of each model and between the rows restored, before
+        any update, raising ``ValidationError`` if any. Returns a counter of the
+        rows restored keyed by model label.
+        """
+        deletion_batches = None
+        if tracks_deletions(queryset.model):
+            deletion_batches = set(queryset.filter(deleted=True).values_list('deletion_batch', flat=True))
+        levels = []
+        for level in self.collect(queryset, deleted=True, deletion_batches=deletion_batches):
+            levels.append(level)
+            if not cascade:
+                break
+        restoring = defaultdict(list)
+        for level in levels:
+            for model, pks in level:
+                restoring[model].append(pks)
+        for model, batches in restoring.items():
+            check_restore_unique(model, batches, self.db_for(model))
+        counts = Counter()
+        for level in levels:
+            counts.update(self.by_alias(level, self.restore_batches))
+        return counts
+
+    def restore_batches(self, using, batches):
+        counts = Counter()
+        for model, pks in batches:
+            batch_qs = model._base_manager.using(using).filter(pk__in=pks)
+            rows = batch_qs.update(**restore_values(model))
+            counts[model._meta.label] += rows
+            count_restored(model, using, rows)
+        return counts
+
+
+def check_restore_unique(model, batches, using):
+    """
+    Raises ``ValidationError`` if restoring the rows, given as batches of
+    primary keys, would duplicate the unique values of an active row or of
+    another row restored. Each unique check of the model takes two queries per
+    batch, the values restored being grouped by the database and compared
+    across batches in python.
+    """
+    instance = model()
+    unique_checks, date_checks = instance._get_unique_checks()
+    errors = {}
+    for model_class, unique_check in unique_checks:
+        if not is_soft_delete_model(model_class) or model_class._meta.pk.name in unique_check:
+            continue
+        # null values never clash
+        not_null = dict(('%s__isnull' % field_name, False) for field_name in unique_check)
+        values = set()
+        for pks in batches:
+            restoring = model._base_manager.using(using).filter(pk__in=pks, **not_null)
+            conflicts = model_class._base_manager.using(using).filter(deleted=False).annotate(
+                restoring=Exists(restoring.filter(**{field_name: OuterRef(field_name) for field_name in unique_check}))
+            ).filter(restoring=True)
+            if conflicts.exists():
+                break
+            grouped = restoring.order_by().values_list(*unique_check).annotate(rows=Count('pk'))
+            if any(row[-1] > 1 or row[:-1] in values for row in grouped):
+                break
+            values.update(row[:-1] for row in grouped)
+        else:
+            continue
+        key = unique_check[0] if len(unique_check) == 1 else NON_FIELD_ERRORS
+        errors.setdefault(key, []).append(instance.unique_error_message(model_class, unique_check))
+    if errors:
+        raise ValidationError(errors)
+
+
+def bulk_unique_errors(objs, batch_size=500):
+    """
+    Checks the unique fields of many objects of one model against the database,
+    and against each other, with one query per unique check and batch of
+    objects. Values are matched in python, as ``validate_unique()`` would
+    compare them one object at a time.
+
+    Returns the errors of each invalid object keyed by its position in ``objs``.
+    """
+    from .constraints import active_unique_checks
+
+    errors = defaultdict(dict)
+    if not objs:
+        return errors
+    unique_checks, date_checks = objs[0]._get_unique_checks()
+    active_checks = active_unique_checks(objs[0].__class__)
+    for model_class, unique_check in unique_checks:
+        attnames = [objs[0]._meta.get_field(field_name).attname for field_name in unique_check]
+        positions = defaultdict(list)
+        for position, obj in enumerate(objs):
+            if obj._unique_lookup(unique_check) is not None:
+                positions[tuple(getattr(obj, attname) for attname in attnames)].append(position)
+
+        def add_error(position):
+            key = unique_check[0] if len(unique_check) == 1 else NON_FIELD_ERRORS
+            errors[position].setdefault(key, []).append(objs[position].unique_error_message(model_class, unique_check))
+
+        # objects repeating the values of an earlier object
+        for duplicates in positions.values():
+            for position in duplicates[1:]:
+                add_error(position)
+
+        queryset = model_class._default_manager.all_with_deleted()
+        if (model_class, tuple(unique_check)) in active_checks:
+            queryset = queryset.filter(deleted=False)
+        values = list(positions)
+        for start in range(0, len(values), batch_size):
+            batch = values[start:start + batch_size]
+            if len(attnames) == 1:
+                batch_qs = queryset.filter(**{'%s__in' % attnames[0]: [value[0] for value in batch]})
+            else:
+                batch_qs = queryset.filter(reduce(operator.or_, [Q(**dict(zip(attnames, value))) for value in batch]))
+            for row in batch_qs.values_list('pk', *attnames):
+                for position in positions[tuple(row[1:])][:1]:
+                    obj = objs[position]
+                    # an object being edited does not clash with its own row
+                    if obj._state.adding or obj._get_pk_val(model_class._meta) != row[0]:
+                        add_error(position)
+    return errors
+
+
+def restore_batch(deletion_batch, using=None, batch_size=SoftDeleteCollector.batch_size):
+    """
+    Restores every row soft deleted with ``deletion_batch``, across all models
+    that track deletions, with one query per model to find the rows and one
+    update per batch of ``batch_size`` of them. As with a queryset restore the
+    rows are checked for unique conflicts before any update, raising
+    ``ValidationError`` if any. Returns a counter of the rows restored keyed
+    by model label.
+    """
+    restoring = []
+    for model in apps.get_models():
+        if tracks_deletions(model):
+            model_using = using or router.db_for_write(model)
+            batch_qs = model._base_manager.using(model_using).filter(deletion_batch=deletion_batch)
+            pks = list(batch_qs.values_list('pk', flat=True))
+            if pks:
+                batches = [pks[start:start + batch_size] for start in range(0, len(pks), batch_size)]
+                check_restore_unique(model, batches, model_using)
+                restoring.append((model, model_using, batches))
+    counts = Counter()
+    for model, model_using, batches in restoring:
+        for pks in batches:
+            restored = model._base_manager.using(model_using).filter(pk__in=pks).update(**restore_values(model))
+            count_restored(model, model_using, restored)
+            counts[model._meta.label] += restored
+    return counts
@@ -0,0 +1,7 @@
+from django.contrib import admin
+
+from soft_delete.admin import ActiveAdmin
+
+from .models import Child
+
+admin.site.register(Child, ActiveAdmin)
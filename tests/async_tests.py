@@ -0,0 +1,59 @@
+from asgiref.sync import async_to_sync
+from django.db import models
+from django.test import TestCase
+
+from soft_delete.asynchronous import AsyncSoftDeleteManager, AsyncSoftDeleteMixin
+
+from .models import Child, Membership, Parent
+
+
+async def collect(aiterable):
+    return [item async for item in aiterable]
+
+
+def manager(model):
+    manager = AsyncSoftDeleteManager()
+    manager.model = model
+    return manager
+
+
+class AsyncTests(TestCase):
+
+    def setUp(self):
+        Parent._meta.get_field('child').rel.on_delete = models.CASCADE
+        Membership._meta.get_field('child').rel.on_delete = models.DO_NOTHING
+        self.children = manager(Child)
+
+    def test_queryset_adelete(self):
+        Parent.objects.create(child=Child.objects.create(name='child'))
+        self.assertEqual(
+            async_to_sync(self.children.all().adelete)(),
+            (2, {'tests.Child': 1, 'tests.Parent': 1})
+        )
+        self.assertEqual(Parent.objects.all().count(), 0)
+
+    def test_queryset_arestore(self):
+        Child.objects.create(name='child', deleted=True)
+        self.assertEqual(async_to_sync(self.children.deleted().arestore)(), (1, {'tests.Child': 1}))
+
+    def test_instance_adelete_and_arestore(self):
+        child = Child.objects.create(name='child')
+        Parent.objects.create(child=child)
+        async_to_sync(AsyncSoftDeleteMixin.adelete)(child)
+        self.assertEqual(Parent.objects.deleted().count(), 1)
+        async_to_sync(AsyncSoftDeleteMixin.arestore)(child)
+        self.assertEqual(Parent.objects.all().count(), 1)
+
+    def test_aget(self):
+        child = Child.objects.create(name='child', deleted=True)
+        self.assertEqual(async_to_sync(self.children.aget)(allow_deleted=True, name='child'), child)
+        with self.assertRaises(Child.DoesNotExist):
+            async_to_sync(self.children.aget)(name='child')
+
+    def test_astream(self):
+        children = [Child.objects.create(name='child %d' % i, deleted=True) for i in range(3)]
+        self.assertEqual(async_to_sync(collect)(self.children.deleted().astream(batch_size=2)), children)
+        self.assertEqual(
+            async_to_sync(collect)(self.children.all_with_deleted().astream(fields=['name'], flat=True)),
+            ['child 0', 'child 1', 'child 2']
+        )
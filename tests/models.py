@@ -1,6 +1,7 @@
 from django.db import models
 
-from soft_delete.models import SoftDeleteAbstract
+from soft_delete.manager import SoftDeleteManager
+from soft_delete.models import SoftDeleteAbstract, SoftDeleteTrackedAbstract
 
 
 class Child(SoftDeleteAbstract):
@@ -34,3 +35,83 @@ class UniqueModel(SoftDeleteAbstract):
 
     class Meta:
         unique_together = ('age', 'gender')
+
+
+class Author(SoftDeleteTrackedAbstract):
+    name = models.CharField(max_length=20)
+
+
+class Book(SoftDeleteTrackedAbstract):
+    author = models.ForeignKey(Author, on_delete=models.CASCADE)
+    title = models.CharField(max_length=20)
+
+
+class Review(SoftDeleteTrackedAbstract):
+    reply_to = models.ForeignKey('self', null=True, on_delete=models.CASCADE)
+
+    def delete(self, using=None, keep_parents=False):
+        # the signature documented by django
+        return super(Review, self).delete(using=using)
+
+
+class BenchmarkRoot(SoftDeleteAbstract):
+    name = models.CharField(max_length=20, unique=True)
+
+
+class BenchmarkBranch(SoftDeleteAbstract):
+    root = models.ForeignKey(BenchmarkRoot, on_delete=models.CASCADE)
+
+
+class BenchmarkLeaf(SoftDeleteAbstract):
+    branch = models.ForeignKey(BenchmarkBranch, on_delete=models.CASCADE)
+
+
+class BenchmarkNode(SoftDeleteAbstract):
+    parent = models.ForeignKey('self', null=True, on_delete=models.CASCADE)
+
+
+class Tag(SoftDeleteAbstract):
+    name = models.CharField(max_length=10)
+
+
+class Topic(SoftDeleteAbstract):
+    tags = models.ManyToManyField(Tag)
+
+
+class CachedParent(SoftDeleteAbstract):
+    name = models.CharField(max_length=10)
+
+
+class CachedChild(SoftDeleteAbstract):
+    name = models.CharField(max_length=10)
+    parent = models.ForeignKey(CachedParent, null=True, on_delete=models.CASCADE)
+
+    objects = SoftDeleteManager(cache_timeout=60)
+
+
+class CountedParent(SoftDeleteTrackedAbstract):
+    name = models.CharField(max_length=10)
+
+    soft_delete_counters = True
+
+
+class CountedChild(SoftDeleteTrackedAbstract):
+    parent = models.ForeignKey(CountedParent, on_delete=models.CASCADE)
+
+    soft_delete_counters = True
+
+
+class Country(SoftDeleteAbstract):
+    code = models.CharField(max_length=2, unique=True)
+
+
+class City(SoftDeleteAbstract):
+    country = models.ForeignKey(Country, to_field='code', on_delete=models.DO_NOTHING)
+
+
+class ShardRoot(SoftDeleteAbstract):
+    name = models.CharField(max_length=10)
+
+
+class ShardLeaf(SoftDeleteAbstract):
+    root = models.ForeignKey(ShardRoot, on_delete=models.CASCADE, db_constraint=False)
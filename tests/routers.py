@@ -0,0 +1,27 @@
+class ShardRouter(object):
+    """
+    Routes ShardLeaf rows to the other database, everything else to default.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.model_name == 'shardleaf':
+            return 'other'
+        return None
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if 'shardleaf' in (obj1._meta.model_name, obj2._meta.model_name):
+            return True
+        return None
+
+
+class ReplicaRouter(object):
+    """
+    Reads CachedChild rows from the other database, as from a replica.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.model_name == 'cachedchild':
+            return 'other'
+        return None
@@ -5,15 +5,23 @@ INSTALLED_APPS = [
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
+    'soft_delete',
     'tests',
 ]
 
+ROOT_URLCONF = 'tests.urls'
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-    }
+    },
+    'other': {
+        'ENGINE': 'django.db.backends.sqlite3',
+    },
 }
 
+DATABASE_ROUTERS = ['tests.routers.ShardRouter']
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
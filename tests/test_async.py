@@ -0,0 +1,5 @@
+import sys
+
+# the async API needs python 3.6, older versions cannot import its tests
+if sys.version_info >= (3, 6):
+    from .async_tests import AsyncTests  # noqa: F401
@@ -0,0 +1,164 @@
+"""
+Benchmarks of the soft delete operations on synthetic wide and deep relation
+graphs. Each measures the queries, wall time and peak python memory of an
+operation and fails when they pass the thresholds, which leave headroom over
+the figures measured on SQLite so only real regressions fail.
+"""
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from soft_delete.utils import related_objects
+from .models import BenchmarkBranch, BenchmarkLeaf, BenchmarkNode, BenchmarkRoot
+
+
+class Measurement(object):
+    queries = 0
+    seconds = 0
+    peak_memory = 0
+
+
+@contextmanager
+def measure():
+    measurement = Measurement()
+    tracemalloc.start()
+    start = time.time()
+    try:
+        with CaptureQueriesContext(connection) as queries:
+            yield measurement
+    finally:
+        measurement.seconds = time.time() - start
+        measurement.peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    measurement.queries = len(queries)
+
+
+def create_wide_graph(roots, branches, leaves, prefix='root'):
+    """
+    Creates ``roots`` roots each with ``branches`` branches each with
+    ``leaves`` leaves, returning the number of rows created.
+    """
+    BenchmarkRoot.objects.bulk_create(BenchmarkRoot(name='%s %d' % (prefix, i)) for i in range(roots))
+    BenchmarkBranch.objects.bulk_create(
+        BenchmarkBranch(root=root) for root in BenchmarkRoot.objects.all() for i in range(branches))
+    BenchmarkLeaf.objects.bulk_create(
+        BenchmarkLeaf(branch=branch) for branch in BenchmarkBranch.objects.all() for i in range(leaves))
+    return roots * (1 + branches * (1 + leaves))
+
+
+def create_deep_graph(depth):
+    """
+    Creates a chain of ``depth`` nodes each the parent of the next, returning
+    the root node.
+    """
+    root = parent = BenchmarkNode.objects.create()
+    for i in range(depth - 1):
+        parent = BenchmarkNode.objects.create(parent=parent)
+    return root
+
+
+class QuerySetDeleteBenchmarks(TestCase):
+
+    def test_wide_graph(self):
+        rows = create_wide_graph(roots=10, branches=10, leaves=10)
+        with measure() as measurement:
+            count, counts = BenchmarkRoot.objects.all().delete()
+        self.assertEqual(count, rows)
+        # one select and update per level, the 1000 leaves in two batches
+        self.assertLessEqual(measurement.queries, 10)
+        self.assertLess(measurement.seconds, 2)
+        self.assertLess(measurement.peak_memory, 2 * 1024 * 1024)
+
+    def test_queries_do_not_grow_with_fan_out(self):
+        create_wide_graph(roots=2, branches=2, leaves=2)
+        with measure() as narrow:
+            BenchmarkRoot.objects.all().delete()
+        create_wide_graph(roots=2, branches=15, leaves=15, prefix='wide')
+        with measure() as wide:
+            BenchmarkRoot.objects.all().delete()
+        # the same while every level fits in one batch
+        self.assertEqual(wide.queries, narrow.queries)
+
+    def test_deep_graph(self):
+        create_deep_graph(depth=200)
+        with measure() as measurement:
+            count, counts = BenchmarkNode.objects.filter(parent=None).delete()
+        self.assertEqual(count, 200)
+        # a select and an update per level, in a savepoint
+        self.assertLessEqual(measurement.queries, 2 * 200 + 4)
+        self.assertLess(measurement.seconds, 5)
+
+
+class InstanceDeleteBenchmarks(TestCase):
+
+    def test_wide_graph(self):
+        create_wide_graph(roots=1, branches=10, leaves=10)
+        root = BenchmarkRoot.objects.get()
+        with measure() as measurement:
+            root.delete()
+        self.assertEqual(BenchmarkLeaf.objects.deleted().count(), 100)
+        # a cascade select and a save per object
+        self.assertLessEqual(measurement.queries, 2 * 111 + 2)
+        self.assertLess(measurement.seconds, 2)
+
+    def test_deep_graph(self):
+        root = create_deep_graph(depth=50)
+        with measure() as measurement:
+            root.delete()
+        self.assertEqual(BenchmarkNode.objects.deleted().count(), 50)
+        self.assertLessEqual(measurement.queries, 2 * 50 + 2)
+        self.assertLess(measurement.seconds, 2)
+
+
+class RestoreBenchmarks(TestCase):
+
+    def test_wide_graph(self):
+        rows = create_wide_graph(roots=10, branches=10, leaves=10)
+        BenchmarkRoot.objects.all().delete()
+        with measure() as measurement:
+            count, counts = BenchmarkRoot.objects.deleted().restore()
+        self.assertEqual(count, rows)
+        # a select, unique check and update per level, in a savepoint
+        self.assertLessEqual(measurement.queries, 16)
+        self.assertLess(measurement.seconds, 2)
+        self.assertLess(measurement.peak_memory, 2 * 1024 * 1024)
+
+
+class RelatedObjectsBenchmarks(TestCase):
+
+    def test_wide_graph(self):
+        create_wide_graph(roots=1, branches=10, leaves=10)
+        root = BenchmarkRoot.objects.get()
+        with measure() as measurement:
+            objects = list(related_objects(root))
+        self.assertEqual(len(objects), 110)
+        # one select per object with relations to follow
+        self.assertLessEqual(measurement.queries, 111)
+        self.assertLess(measurement.seconds, 2)
+        self.assertLess(measurement.peak_memory, 2 * 1024 * 1024)
+
+
+class UniqueChecksBenchmarks(TestCase):
+
+    def test_perform_unique_checks(self):
+        create_wide_graph(roots=100, branches=0, leaves=0)
+        obj = BenchmarkRoot(name='root 50')
+        unique_checks, date_checks = obj._get_unique_checks()
+        with measure() as measurement:
+            errors = obj._perform_unique_checks(unique_checks)
+        self.assertIn('name', errors)
+        self.assertEqual(measurement.queries, 1)
+
+    def test_validate_unique_bulk(self):
+        create_wide_graph(roots=100, branches=0, leaves=0)
+        objs = [BenchmarkRoot(name='root %d' % i) for i in range(50, 1050)]
+        with measure() as measurement:
+            errors = BenchmarkRoot.objects.validate_unique_bulk(objs)
+        self.assertEqual(len(errors), 50)
+        # one query per batch of 500
+        self.assertEqual(measurement.queries, 2)
+        self.assertLess(measurement.seconds, 2)
@@ -0,0 +1,64 @@
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+from django.utils.six import StringIO
+
+from soft_delete.models import SoftDeleteJob
+
+from .models import Author, Book, Child
+
+
+class PurgeSoftDeletedTests(TestCase):
+
+    def call(self, *args, **kwargs):
+        out = StringIO()
+        call_command('purge_soft_deleted', *args, stdout=out, **kwargs)
+        return out.getvalue()
+
+    def test_purges_all_models(self):
+        Child.objects.create(name='bill', deleted=True)
+        Author.objects.create(name='author', deleted=True)
+        self.assertEqual(self.call(), 'Purged 1 tests.Child\nPurged 1 tests.Author\n')
+        self.assertEqual(Child.objects.all_with_deleted().count(), 0)
+
+    def test_purges_given_models(self):
+        Child.objects.create(name='bill', deleted=True)
+        Author.objects.create(name='author', deleted=True)
+        self.assertEqual(self.call('tests.Child'), 'Purged 1 tests.Child\n')
+        self.assertEqual(Author.objects.all_with_deleted().count(), 1)
+
+    def test_dry_run(self):
+        Child.objects.create(name='bill', deleted=True)
+        self.assertEqual(self.call('tests.Child', dry_run=True), 'Would purge 1 tests.Child\n')
+        self.assertEqual(Child.objects.all_with_deleted().count(), 1)
+
+    def test_older_than_skips_models_without_deleted_at(self):
+        Child.objects.create(name='bill', deleted=True)
+        self.assertEqual(self.call(older_than_days=0), '')
+        self.assertEqual(Child.objects.all_with_deleted().count(), 1)
+
+    def test_rejects_models_that_are_not_soft_delete(self):
+        with self.assertRaises(CommandError):
+            self.call('auth.User')
+
+
+class ProcessSoftDeleteJobsTests(TestCase):
+
+    def call(self, *args, **kwargs):
+        out = StringIO()
+        call_command('process_soft_delete_jobs', *args, stdout=out, **kwargs)
+        return out.getvalue()
+
+    def test_processes_queue_once(self):
+        author = Author.objects.create(name='author')
+        Book.objects.create(author=author, title='book')
+        Author.objects.all().delete(deferred=True)
+        self.assertEqual(self.call(once=True), 'Processed 2 batches\n')
+        self.assertEqual(Book.objects.count(), 0)
+        self.assertTrue(SoftDeleteJob.objects.get().finished)
+
+    def test_max_batches(self):
+        author = Author.objects.create(name='author')
+        Book.objects.create(author=author, title='book')
+        Author.objects.all().delete(deferred=True)
+        self.assertEqual(self.call(max_batches=1), 'Processed 1 batches\n')
+        self.assertFalse(SoftDeleteJob.objects.get().finished)
@@ -1,10 +1,30 @@
-from django.core.exceptions import ValidationError
-from django.db import models
-from django.test import TestCase
+import uuid
+from datetime import timedelta
+from unittest import mock, skipIf, skipUnless
 
-from tests.models import Child, Group, Membership, Parent, UniqueModel
+from django.core.exceptions import NON_FIELD_ERRORS, ImproperlyConfigured, ValidationError
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models.signals import post_save
+from django.db.models import Q, QuerySet
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from tests.models import (
+    Author, BenchmarkNode, Book, CachedChild, CachedParent, Child, CountedChild, CountedParent, Group, Membership,
+    Parent, Review, UniqueModel)
+from soft_delete.checks import check_active_unique_constraints
+from soft_delete.constraints import (
+    active_index, active_unique_checks, active_unique_constraint, is_active_unique_constraint, supports_conditions
+)
+from soft_delete.counters import create_counters
+from soft_delete.instrumentation import CascadeLimitExceeded
+from soft_delete.deferred import next_batch, process_jobs
+from soft_delete.helpers import soft_delete_prefetch
 from soft_delete.manager import SoftDeleteManager
-from soft_delete.models import SoftDeleteAbstract
+from soft_delete.models import SoftDeleteAbstract, SoftDeleteCounter, SoftDeleteJob
+from soft_delete.signals import post_soft_delete, pre_soft_delete, soft_delete_level
+from soft_delete.utils import SoftDeleteCollector, cascade_plan, clear_cascade_plans, related_objects
 
 
 class ModelManagerTests(TestCase):
@@ -116,6 +136,28 @@ class CascadeForeignKeyTests(TestCase):
         self.assertEqual(Parent.objects.all().count(), 0)
         self.assertEqual(Parent.objects.deleted().count(), 1)
 
+    def test_row_referencing_itself_is_deleted_once(self):
+        node = BenchmarkNode.objects.create()
+        node.parent = node
+        node.save()
+        node.delete()
+        self.assertEqual(BenchmarkNode.objects.deleted().count(), 1)
+
+    def test_rows_referencing_each_other_are_deleted_once(self):
+        first = BenchmarkNode.objects.create()
+        second = BenchmarkNode.objects.create(parent=first)
+        first.parent = second
+        first.save()
+        first.delete()
+        self.assertEqual(BenchmarkNode.objects.deleted().count(), 2)
+
+    def test_per_object_delete_of_a_cycle(self):
+        first = BenchmarkNode.objects.create()
+        second = BenchmarkNode.objects.create(parent=first)
+        first.parent = second
+        first.save()
+        self.assertEqual(BenchmarkNode.objects.all().delete(bulk=False), (2, {'tests.BenchmarkNode': 2}))
+
 
 class CascadeManyToManyThroughTests(TestCase):
 
@@ -175,6 +217,802 @@ class CascadeManyToManyThroughTests(TestCase):
         self.assertEqual(Child.objects.deleted().count(), 1)
 
 
+class RelatedManagerTests(TestCase):
+
+    def setUp(self):
+        self.child1 = Child.objects.create(name='child 1')
+        self.child2 = Child.objects.create(name='child 2')
+        self.child3 = Child.objects.create(name='child 3', deleted=True)
+        self.group = Group.objects.create(name='group')
+        Membership.objects.create(group=self.group, child=self.child1)
+        Membership.objects.create(group=self.group, child=self.child2, deleted=True)
+        Membership.objects.create(group=self.group, child=self.child3)
+        Parent.objects.create(child=self.child1)
+        Parent.objects.create(child=self.child1, deleted=True)
+
+    def test_many_to_many_leaves_out_deleted_through_rows(self):
+        self.assertEqual(list(self.group.members.all()), [self.child1])
+        self.assertEqual(self.group.members.count(), 1)
+        self.assertEqual(list(self.child2.group_set.all()), [])
+        self.assertEqual(list(self.group.members.filter(name__startswith='child')), [self.child1])
+
+    def test_many_to_many_joins_the_through_table_once(self):
+        for members in (self.group.members, self.group.members.db_manager('default'), self.child1.group_set):
+            with self.assertNumQueries(1) as queries:
+                self.assertEqual(len(members.all()), 1)
+            self.assertEqual(queries.captured_queries[0]['sql'].count('JOIN'), 1)
+
+    def test_prefetch_many_to_many_in_one_query(self):
+        Group.objects.create(name='other')
+        with self.assertNumQueries(2) as queries:
+            groups = list(Group.objects.prefetch_related('members'))
+            self.assertEqual([list(g.members.all()) for g in groups], [[self.child1], []])
+        self.assertEqual(queries.captured_queries[1]['sql'].count('JOIN'), 1)
+
+    def test_prefetch_reverse_foreign_key(self):
+        with self.assertNumQueries(2):
+            children = list(Child.objects.prefetch_related('parent_set'))
+            self.assertEqual([len(c.parent_set.all()) for c in children], [1, 0])
+
+    def test_prefetch_include_deleted(self):
+        with self.assertNumQueries(2):
+            group = Group.objects.prefetch_related(
+                soft_delete_prefetch('members', Child, include_deleted=True, to_attr='all_members')).get()
+            self.assertEqual(group.all_members, [self.child1, self.child2, self.child3])
+
+    def test_prefetch_to_attr(self):
+        group = Group.objects.prefetch_related(soft_delete_prefetch('members', Child, to_attr='active')).get()
+        self.assertEqual(group.active, [self.child1])
+
+
+class CachedGetTests(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.parent = CachedParent.objects.create(name='parent')
+        self.child = CachedChild.objects.create(name='child', parent=self.parent)
+
+    def test_get_by_pk_is_cached(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(CachedChild.objects.get(pk=self.child.pk), self.child)
+            self.assertEqual(CachedChild.objects.get(pk=self.child.pk).name, 'child')
+
+    def test_other_lookups_are_not_cached(self):
+        with self.assertNumQueries(2):
+            CachedChild.objects.get(name='child')
+            CachedChild.objects.get(name='child')
+
+    def test_uncached_manager(self):
+        child = Child.objects.create(name='child')
+        with self.assertNumQueries(2):
+            Child.objects.get(pk=child.pk)
+            Child.objects.get(pk=child.pk)
+
+    def test_related_manager_is_not_cached(self):
+        with self.assertNumQueries(2):
+            self.parent.cachedchild_set.get(pk=self.child.pk)
+            self.parent.cachedchild_set.get(pk=self.child.pk)
+
+    def test_save_invalidates(self):
+        CachedChild.objects.get(pk=self.child.pk)
+        self.child.name = 'renamed'
+        self.child.save()
+        self.assertEqual(CachedChild.objects.get(pk=self.child.pk).name, 'renamed')
+
+    def test_delete_invalidates(self):
+        CachedChild.objects.get(pk=self.child.pk)
+        self.child.delete()
+        self.assertTrue(CachedChild.objects.get(pk=self.child.pk).deleted)
+
+    def test_bulk_cascade_invalidates(self):
+        CachedChild.objects.get(pk=self.child.pk)
+        CachedParent.objects.filter(pk=self.parent.pk).delete()
+        self.assertTrue(CachedChild.objects.get(pk=self.child.pk).deleted)
+
+    def test_restore_invalidates(self):
+        self.child.delete()
+        CachedChild.objects.get(pk=self.child.pk)
+        self.child.restore()
+        self.assertFalse(CachedChild.objects.get(pk=self.child.pk).deleted)
+
+    def test_update_invalidates(self):
+        CachedChild.objects.get(pk=self.child.pk)
+        CachedChild.objects.all().update(name='updated')
+        self.assertEqual(CachedChild.objects.get(pk=self.child.pk).name, 'updated')
+
+    def test_rows_read_in_a_transaction_are_not_cached(self):
+        self.child.delete()
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                self.child.restore()
+                self.assertFalse(CachedChild.objects.get(pk=self.child.pk).deleted)
+                raise ValueError
+        self.assertTrue(CachedChild.objects.get(pk=self.child.pk).deleted)
+
+    def test_purge_invalidates(self):
+        self.child.delete()
+        CachedChild.objects.get(pk=self.child.pk)
+        CachedChild.objects.purge()
+        with self.assertRaises(CachedChild.DoesNotExist):
+            CachedChild.objects.get(pk=self.child.pk)
+
+
+class StatsTests(TestCase):
+
+    def setUp(self):
+        self.parent = CountedParent.objects.create(name='parent')
+        self.children = [CountedChild.objects.create(parent=self.parent) for i in range(3)]
+
+    def counters(self):
+        return CountedParent.objects.stats(counters=True), CountedChild.objects.stats(counters=True)
+
+    def stats(self):
+        return CountedParent.objects.stats(), CountedChild.objects.stats()
+
+    def test_stats_in_one_query(self):
+        Child.objects.create(name='child 1')
+        Child.objects.create(name='child 2', deleted=True)
+        with self.assertNumQueries(1):
+            self.assertEqual(Child.objects.stats(), {'active': 1, 'deleted': 1, 'total': 2})
+        self.assertEqual(Child.objects.all_with_deleted().filter(name='child 2').stats()['deleted'], 1)
+        self.assertEqual(UniqueModel.objects.stats(), {'active': 0, 'deleted': 0, 'total': 0})
+
+    def test_counters_need_enabling(self):
+        with self.assertRaises(ValueError):
+            Child.objects.stats(counters=True)
+
+    def test_counters_read_in_one_query(self):
+        CountedChild.objects.stats(counters=True)
+        with self.assertNumQueries(1):
+            self.assertEqual(CountedChild.objects.stats(counters=True), {'active': 3, 'deleted': 0, 'total': 3})
+
+    def test_counters_follow_deletes_and_restores(self):
+        self.counters()
+        self.children[0].delete()
+        self.assertEqual(self.counters(), self.stats())
+        CountedParent.objects.all().delete()
+        self.assertEqual(self.counters(), self.stats())
+        self.assertEqual(CountedChild.objects.stats(counters=True)['deleted'], 3)
+        CountedParent.objects.deleted().restore()
+        self.assertEqual(self.counters(), self.stats())
+        self.parent.delete()
+        self.assertEqual(self.counters(), self.stats())
+        CountedParent.objects.restore_batch(self.parent.deletion_batch)
+        self.assertEqual(self.counters(), self.stats())
+
+    def test_counters_follow_creates_and_purges(self):
+        self.counters()
+        CountedChild.objects.create(parent=self.parent, deleted=True)
+        self.assertEqual(self.counters(), self.stats())
+        CountedChild.objects.purge()
+        self.assertEqual(self.counters(), self.stats())
+
+    def test_counters_follow_deletes_of_unsaved_rows(self):
+        self.counters()
+        CountedParent(name='unsaved').delete()
+        self.assertEqual(self.counters(), self.stats())
+        self.assertEqual(CountedParent.objects.stats(counters=True), {'active': 1, 'deleted': 1, 'total': 2})
+
+    def test_counters_follow_deferred_deletes(self):
+        self.counters()
+        CountedParent.objects.all().delete(deferred=True)
+        process_jobs()
+        self.assertEqual(self.counters(), self.stats())
+
+    def test_refresh_counters(self):
+        self.counters()
+        CountedChild.objects.bulk_create([CountedChild(parent=self.parent)])
+        self.assertEqual(CountedChild.objects.refresh_counters(), {'active': 4, 'deleted': 0, 'total': 4})
+        self.assertEqual(CountedChild.objects.stats(counters=True)['active'], 4)
+
+    def test_counters_created_by_migrate(self):
+        SoftDeleteCounter.objects.all().delete()
+        create_counters('default')
+        self.assertEqual(
+            dict(SoftDeleteCounter.objects.values_list('model', 'active')),
+            {'tests.CountedParent': 1, 'tests.CountedChild': 3})
+
+    def test_writes_do_not_create_counters(self):
+        SoftDeleteCounter.objects.all().delete()
+        with self.assertNumQueries(2):
+            CountedChild.objects.create(parent=self.parent)
+        self.assertFalse(SoftDeleteCounter.objects.exists())
+        self.assertEqual(self.counters(), self.stats())
+
+    def test_refresh_counters_created_concurrently(self):
+        update = QuerySet.update
+        calls = []
+
+        def missing_once(queryset, **kwargs):
+            calls.append(kwargs)
+            return 0 if len(calls) == 1 else update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', missing_once):
+            self.assertEqual(CountedChild.objects.refresh_counters()['active'], 3)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(SoftDeleteCounter.objects.get(model='tests.CountedChild').active, 3)
+
+
+class DeletePreviewTests(TestCase):
+
+    def setUp(self):
+        Parent._meta.get_field('child').rel.on_delete = models.CASCADE
+        Membership._meta.get_field('child').rel.on_delete = models.CASCADE
+        self.author = Author.objects.create(name='author')
+        self.books = [Book.objects.create(author=self.author, title='book %d' % i) for i in range(3)]
+        self.books[2].delete()
+
+    def tearDown(self):
+        Parent._meta.get_field('child').rel.on_delete = models.DO_NOTHING
+        Membership._meta.get_field('child').rel.on_delete = models.DO_NOTHING
+
+    def test_counts_with_one_query_per_model(self):
+        with self.assertNumQueries(2):
+            self.assertEqual(
+                Author.objects.all().delete_preview(), (3, {'tests.Author': 1, 'tests.Book': 2}, {}))
+        self.assertEqual(Book.objects.count(), 2)
+
+    def test_samples(self):
+        total, counts, samples = self.author.delete_preview(sample_size=1)
+        self.assertEqual(samples, {'tests.Author': [self.author.pk], 'tests.Book': [self.books[0].pk]})
+
+    def test_matches_delete(self):
+        child = Child.objects.create(name='child')
+        group = Group.objects.create(name='group')
+        Parent.objects.create(child=child)
+        Membership.objects.create(child=child, group=group)
+        Membership.objects.create(child=child, group=group, deleted=True)
+        preview = Child.objects.all().delete_preview()
+        self.assertEqual(preview[:2], Child.objects.all().delete())
+        self.assertEqual(preview[1], {'tests.Child': 1, 'tests.Parent': 1, 'tests.Membership': 1})
+
+    def test_self_referencing_cascade(self):
+        root = BenchmarkNode.objects.create()
+        node = BenchmarkNode.objects.create(parent=root)
+        BenchmarkNode.objects.create(parent=node)
+        total, counts, samples = BenchmarkNode.objects.filter(pk=root.pk).delete_preview(sample_size=2)
+        self.assertEqual(total, 3)
+        self.assertEqual(len(samples['tests.BenchmarkNode']), 2)
+        self.assertEqual(BenchmarkNode.objects.count(), 3)
+
+    def test_deleted_rows_preview_nothing(self):
+        self.assertEqual(self.books[2].delete_preview(), (0, {}, {}))
+
+
+class StreamTests(TestCase):
+
+    def setUp(self):
+        self.children = [Child.objects.create(name='child %d' % i, deleted=i % 2 == 0) for i in range(5)]
+
+    def test_stream_yields_objects_in_pk_order(self):
+        self.assertEqual(list(Child.objects.all_with_deleted().stream(batch_size=2)), self.children)
+
+    def test_stream_keeps_filters(self):
+        self.assertEqual(list(Child.objects.deleted().stream(batch_size=2)), self.children[::2])
+
+    def test_stream_queries_per_batch(self):
+        with self.assertNumQueries(3):
+            list(Child.objects.all_with_deleted().stream(batch_size=2))
+        with self.assertNumQueries(2):
+            list(Child.objects.all_with_deleted().stream(batch_size=5))
+
+    def test_stream_values(self):
+        self.assertEqual(
+            list(Child.objects.all().stream(batch_size=1, fields=['name', 'deleted'])),
+            [('child 1', False), ('child 3', False)]
+        )
+
+    def test_stream_flat_values(self):
+        self.assertEqual(list(Child.objects.all().stream(fields=['name'], flat=True)), ['child 1', 'child 3'])
+
+    def test_stream_flat_needs_one_field(self):
+        with self.assertRaises(TypeError):
+            list(Child.objects.all().stream(fields=['name', 'deleted'], flat=True))
+
+
+class PurgeTests(TestCase):
+
+    def setUp(self):
+        Parent._meta.get_field('child').rel.on_delete = models.CASCADE
+        Membership._meta.get_field('child').rel.on_delete = models.DO_NOTHING
+
+    def test_purge_deletes_only_deleted_rows(self):
+        Child.objects.create(name='bill', deleted=True)
+        Child.objects.create(name='ben')
+        self.assertEqual(Child.objects.purge(), {'tests.Child': 1})
+        self.assertEqual(Child.objects.all_with_deleted().count(), 1)
+
+    def test_purge_deletes_dependents_first(self):
+        child = Child.objects.create(name='child')
+        Parent.objects.create(child=child)
+        child.delete()
+        self.assertEqual(Child.objects.purge(), {'tests.Child': 1, 'tests.Parent': 1})
+        self.assertEqual(Parent.objects.all_with_deleted().count(), 0)
+
+    def test_purge_keeps_rows_referenced_by_active_rows(self):
+        child = Child.objects.create(name='child', deleted=True)
+        group = Group.objects.create(name='group')
+        Membership.objects.create(child=child, group=group)
+        self.assertEqual(Child.objects.purge(), {})
+        self.assertEqual(Child.objects.deleted().count(), 1)
+
+    def test_purge_in_chunks(self):
+        for i in range(5):
+            Child.objects.create(name='child %d' % i, deleted=True)
+        with mock.patch('soft_delete.purge.time.sleep') as sleep:
+            self.assertEqual(Child.objects.purge(chunk_size=2, sleep=1), {'tests.Child': 5})
+        self.assertEqual(sleep.call_count, 2)
+
+    def test_purge_dry_run(self):
+        child = Child.objects.create(name='child')
+        Parent.objects.create(child=child)
+        child.delete()
+        self.assertEqual(Child.objects.purge(dry_run=True), {'tests.Child': 1, 'tests.Parent': 1})
+        self.assertEqual(Child.objects.deleted().count(), 1)
+        self.assertEqual(Parent.objects.deleted().count(), 1)
+
+    def test_purge_older_than(self):
+        author = Author.objects.create(name='author')
+        author.delete()
+        self.assertEqual(Author.objects.purge(older_than=timedelta(days=1)), {})
+        Author.objects.all_with_deleted().update(deleted_at=timezone.now() - timedelta(days=2))
+        self.assertEqual(Author.objects.purge(older_than=timedelta(days=1)), {'tests.Author': 1})
+
+    def test_purge_older_than_keeps_newer_dependents(self):
+        author = Author.objects.create(name='author')
+        Book.objects.create(author=author, title='book')
+        author.delete()
+        Author.objects.all_with_deleted().update(deleted_at=timezone.now() - timedelta(days=2))
+        self.assertEqual(Author.objects.purge(older_than=timedelta(days=1)), {})
+        self.assertEqual(Book.objects.deleted().count(), 1)
+        Book.objects.all_with_deleted().update(deleted_at=timezone.now() - timedelta(days=2))
+        self.assertEqual(Author.objects.purge(older_than=timedelta(days=1)), {'tests.Author': 1, 'tests.Book': 1})
+
+    def test_purge_keeps_rows_with_deleted_dependents_that_do_not_cascade(self):
+        Parent._meta.get_field('child').rel.on_delete = models.DO_NOTHING
+        child = Child.objects.create(name='child', deleted=True)
+        Parent.objects.create(child=child, deleted=True)
+        self.assertEqual(Child.objects.purge(), {})
+        self.assertEqual(Parent.objects.deleted().count(), 1)
+
+    def test_purge_older_than_needs_deleted_at(self):
+        with self.assertRaises(ValueError):
+            Child.objects.purge(older_than=timedelta(days=1))
+
+
+class BulkDeleteQuerySetTests(TestCase):
+
+    def setUp(self):
+        Parent._meta.get_field('child').rel.on_delete = models.DO_NOTHING
+        Membership._meta.get_field('child').rel.on_delete = models.DO_NOTHING
+
+    def test_bulk_delete_returns_counts(self):
+        Child.objects.create(name='bill')
+        Child.objects.create(name='ben')
+        self.assertEqual(Child.objects.all().delete(), (2, {'tests.Child': 2}))
+        self.assertEqual(Child.objects.deleted().count(), 2)
+
+    def test_bulk_delete_uses_one_update_per_model(self):
+        Parent._meta.get_field('child').rel.on_delete = models.CASCADE
+        for i in range(5):
+            Parent.objects.create(child=Child.objects.create(name='child %d' % i))
+        # select root pks, update roots, select parent pks, update parents, in a savepoint
+        with self.assertNumQueries(6):
+            Child.objects.all().delete()
+        self.assertEqual(Child.objects.all().count(), 0)
+        self.assertEqual(Parent.objects.all().count(), 0)
+
+    def test_bulk_delete_cascades_through_m2m_model(self):
+        Membership._meta.get_field('child').rel.on_delete = models.CASCADE
+        group = Group.objects.create(name='group')
+        child1 = Child.objects.create(name='child 1')
+        child2 = Child.objects.create(name='child 2')
+        Membership.objects.create(group=group, child=child1)
+        Membership.objects.create(group=group, child=child2)
+        count, counts = Child.objects.filter(pk=child1.pk).delete()
+        self.assertEqual(count, 2)
+        self.assertEqual(counts, {'tests.Child': 1, 'tests.Membership': 1})
+        self.assertEqual(Membership.objects.all().count(), 1)
+        self.assertEqual(Group.objects.all().count(), 1)
+
+    def test_bulk_delete_skips_already_deleted_rows(self):
+        Child.objects.create(name='bill', deleted=True)
+        Child.objects.create(name='ben')
+        self.assertEqual(Child.objects.all_with_deleted().delete(), (1, {'tests.Child': 1}))
+
+    def test_per_instance_delete_calls_object_delete(self):
+        Child.objects.create(name='bill')
+        Child.objects.create(name='ben')
+        with mock.patch.object(Child, 'delete', autospec=True) as delete:
+            Child.objects.all().delete(bulk=False)
+        self.assertEqual(delete.call_count, 2)
+
+    def test_per_instance_delete_returns_rows_affected(self):
+        Child.objects.create(name='bill')
+        Child.objects.create(name='ben')
+        self.assertEqual(Child.objects.all().delete(bulk=False), (2, {'tests.Child': 2}))
+
+
+class SoftDeleteCollectorTests(TestCase):
+
+    def setUp(self):
+        Parent._meta.get_field('child').rel.on_delete = models.CASCADE
+        Membership._meta.get_field('child').rel.on_delete = models.DO_NOTHING
+
+    def test_batches_skip_collected_pks(self):
+        collector = SoftDeleteCollector('default', batch_size=2)
+        self.assertEqual(list(collector.batches(Child, [1, 2, 3])), [(Child, [1, 2]), (Child, [3])])
+        self.assertEqual(list(collector.batches(Child, [3, 4, 1])), [(Child, [4])])
+
+    def test_collect_yields_levels(self):
+        child1 = Child.objects.create(name='child 1')
+        child2 = Child.objects.create(name='child 2')
+        parent = Parent.objects.create(child=child1)
+        levels = list(SoftDeleteCollector('default').collect(Child.objects.all()))
+        self.assertEqual(levels, [[(Child, [child1.pk, child2.pk])], [(Parent, [parent.pk])]])
+
+    def test_delete_updates_in_batches(self):
+        for i in range(5):
+            Parent.objects.create(child=Child.objects.create(name='child %d' % i))
+        # select root pks, 3 root updates, 3 parent selects, 3 parent updates, in a savepoint
+        with self.assertNumQueries(12):
+            count, counts = Child.objects.all().delete(batch_size=2)
+        self.assertEqual(counts, {'tests.Child': 5, 'tests.Parent': 5})
+        self.assertEqual(Parent.objects.all().count(), 0)
+
+
+class InstrumentationTests(TestCase):
+
+    def setUp(self):
+        Parent._meta.get_field('child').rel.on_delete = models.CASCADE
+        Membership._meta.get_field('child').rel.on_delete = models.DO_NOTHING
+        self.child = Child.objects.create(name='child')
+        Parent.objects.create(child=self.child)
+        Parent.objects.create(child=self.child)
+
+    def receive(self, signal):
+        calls = []
+
+        def receiver(**kwargs):
+            calls.append(kwargs)
+        signal.connect(receiver)
+        self.addCleanup(signal.disconnect, receiver)
+        return calls
+
+    def test_signals_sent_around_queryset_delete(self):
+        pre = self.receive(pre_soft_delete)
+        levels = self.receive(soft_delete_level)
+        post = self.receive(post_soft_delete)
+        Child.objects.all().delete()
+        self.assertEqual(len(pre), 1)
+        self.assertEqual(pre[0]['sender'], Child)
+        self.assertEqual([(level['level'], level['rows']) for level in levels], [
+            (0, {'tests.Child': 1}),
+            (1, {'tests.Parent': 2}),
+        ])
+        self.assertEqual(len(post), 1)
+        self.assertEqual(post[0]['rows'], {'tests.Child': 1, 'tests.Parent': 2})
+        self.assertGreaterEqual(post[0]['elapsed'], 0)
+
+    def test_signals_sent_once_for_instance_cascade(self):
+        pre = self.receive(pre_soft_delete)
+        post = self.receive(post_soft_delete)
+        self.child.delete()
+        self.assertEqual(len(pre), 1)
+        self.assertEqual(len(post), 1)
+        self.assertEqual(post[0]['sender'], Child)
+        self.assertEqual(post[0]['rows'], {'tests.Child': 1, 'tests.Parent': 2})
+
+    def test_queryset_delete_over_limit(self):
+        post = self.receive(post_soft_delete)
+        with self.assertRaises(CascadeLimitExceeded) as cm:
+            Child.objects.all().delete(max_cascade_rows=2)
+        self.assertEqual(cm.exception.rows, {'tests.Child': 1, 'tests.Parent': 2})
+        self.assertEqual(Child.objects.all().count(), 1)
+        self.assertEqual(Parent.objects.all().count(), 2)
+        self.assertEqual(post, [])
+
+    def test_per_object_queryset_delete_over_limit(self):
+        with self.assertRaises(CascadeLimitExceeded):
+            Child.objects.all().delete(bulk=False, max_cascade_rows=2)
+        self.assertEqual(Parent.objects.all().count(), 2)
+
+    def test_instance_delete_over_limit(self):
+        with self.assertRaises(CascadeLimitExceeded):
+            self.child.delete(max_cascade_rows=2)
+        self.assertEqual(Child.objects.all().count(), 1)
+        self.assertEqual(Parent.objects.all().count(), 2)
+
+    def test_delete_within_limit(self):
+        self.assertEqual(Child.objects.all().delete(max_cascade_rows=3)[0], 3)
+
+    def test_limit_setting(self):
+        with self.settings(SOFT_DELETE_MAX_CASCADE_ROWS=2):
+            with self.assertRaises(CascadeLimitExceeded):
+                self.child.delete()
+
+
+class CascadePlanTests(TestCase):
+
+    def setUp(self):
+        Parent._meta.get_field('child').rel.on_delete = models.DO_NOTHING
+        Membership._meta.get_field('child').rel.on_delete = models.DO_NOTHING
+
+    def test_plan_is_memoized_per_model(self):
+        self.assertIs(cascade_plan(Child), cascade_plan(Child))
+
+    def test_plan_is_rebuilt_after_clearing(self):
+        plan = cascade_plan(Child)
+        clear_cascade_plans()
+        self.assertIsNot(cascade_plan(Child), plan)
+
+    def test_plan_contains_reverse_relations(self):
+        plan = cascade_plan(Child)
+        self.assertEqual(
+            {(relation.model, relation.field.name) for relation in plan},
+            {(Parent, 'child'), (Membership, 'child')}
+        )
+        self.assertTrue(all(relation.soft_delete for relation in plan))
+
+    def test_plan_reads_on_delete_when_used(self):
+        relation = [r for r in cascade_plan(Child) if r.model is Parent][0]
+        self.assertFalse(relation.cascades)
+        Parent._meta.get_field('child').rel.on_delete = models.CASCADE
+        self.assertTrue(relation.cascades)
+
+    def test_related_objects_follows_cascades(self):
+        Parent._meta.get_field('child').rel.on_delete = models.CASCADE
+        child = Child.objects.create(name='child')
+        parent = Parent.objects.create(child=child)
+        Membership.objects.create(child=child, group=Group.objects.create(name='group'))
+        self.assertEqual(list(related_objects(child)), [parent])
+
+
+class DeletionBatchTests(TestCase):
+
+    def setUp(self):
+        self.author = Author.objects.create(name='author')
+        self.book1 = Book.objects.create(author=self.author, title='book 1')
+        self.book2 = Book.objects.create(author=self.author, title='book 2')
+
+    def test_instance_delete_records_batch_on_cascade(self):
+        self.author.delete()
+        self.assertIsNotNone(self.author.deleted_at)
+        self.assertIsNotNone(self.author.deletion_batch)
+        self.assertEqual(
+            set(Book.objects.deleted().values_list('deletion_batch', flat=True)),
+            {self.author.deletion_batch}
+        )
+
+    def test_queryset_delete_records_given_batch(self):
+        batch = uuid.uuid4()
+        Author.objects.all().delete(deletion_batch=batch)
+        self.assertEqual(Author.objects.get(pk=self.author.pk).deletion_batch, batch)
+        self.assertEqual(Book.objects.deleted().filter(deletion_batch=batch).count(), 2)
+        self.assertFalse(Book.objects.deleted().filter(deleted_at=None).exists())
+
+    def test_restore_batch_restores_every_model(self):
+        batch = uuid.uuid4()
+        Author.objects.all().delete(deletion_batch=batch)
+        # one query per model tracking deletions and one update per model
+        # restored, inside a savepoint
+        with self.assertNumQueries(9):
+            self.assertEqual(Book.objects.restore_batch(batch), (3, {'tests.Author': 1, 'tests.Book': 2}))
+        self.assertEqual(Author.objects.all().count(), 1)
+        self.assertEqual(Book.objects.all().count(), 2)
+        self.assertFalse(Book.objects.exclude(deletion_batch=None).exists())
+
+    def test_restore_batch_leaves_other_batches(self):
+        self.book1.delete()
+        self.author.delete()
+        Author.objects.restore_batch(self.author.deletion_batch)
+        self.assertEqual(list(Book.objects.all()), [self.book2])
+
+    def test_deleted_rows_keep_their_batch(self):
+        self.author.delete()
+        batch = self.author.deletion_batch
+        self.author.delete()
+        self.assertEqual(self.author.deletion_batch, batch)
+        self.assertEqual(Author.objects.all_with_deleted().delete(bulk=False), (0, {}))
+        self.assertEqual(Author.objects.deleted().get().deletion_batch, batch)
+        Author.objects.restore_batch(batch)
+        self.assertEqual(Author.objects.count(), 1)
+        self.assertEqual(Book.objects.count(), 2)
+
+    def test_overridden_delete_shares_the_batch(self):
+        review = Review.objects.create()
+        reply = Review.objects.create(reply_to=review)
+        self.assertEqual(Review.objects.filter(pk=review.pk).delete(bulk=False), (2, {'tests.Review': 2}))
+        batch = Review.objects.deleted().get(pk=review.pk).deletion_batch
+        self.assertEqual(Review.objects.deleted().get(pk=reply.pk).deletion_batch, batch)
+        reply = Review.objects.deleted().get(pk=reply.pk)
+        reply.restore(cascade=False)
+        reply.delete()
+        self.assertNotEqual(reply.deletion_batch, batch)
+
+
+class RestoreTests(TestCase):
+
+    def setUp(self):
+        Parent._meta.get_field('child').rel.on_delete = models.CASCADE
+        Membership._meta.get_field('child').rel.on_delete = models.DO_NOTHING
+
+    def test_restore_queryset(self):
+        Child.objects.create(name='bill', deleted=True)
+        Child.objects.create(name='ben', deleted=True)
+        self.assertEqual(Child.objects.deleted().restore(), (2, {'tests.Child': 2}))
+        self.assertEqual(Child.objects.all().count(), 2)
+
+    def test_restore_instance_cascades(self):
+        child = Child.objects.create(name='child')
+        Parent.objects.create(child=child)
+        child.delete()
+        self.assertEqual(child.restore(), (2, {'tests.Child': 1, 'tests.Parent': 1}))
+        self.assertFalse(child.deleted)
+        self.assertEqual(Parent.objects.all().count(), 1)
+
+    def test_restore_instance_without_cascade(self):
+        child = Child.objects.create(name='child')
+        Parent.objects.create(child=child)
+        child.delete()
+        child.restore(cascade=False)
+        self.assertEqual(Child.objects.all().count(), 1)
+        self.assertEqual(Parent.objects.all().count(), 0)
+
+    def test_restore_only_cascades_to_the_same_batch(self):
+        author = Author.objects.create(name='author')
+        book1 = Book.objects.create(author=author, title='book 1')
+        book2 = Book.objects.create(author=author, title='book 2')
+        book1.delete()
+        author.delete()
+        author.restore()
+        self.assertEqual(list(Book.objects.all()), [book2])
+        self.assertIsNone(author.deletion_batch)
+
+    # the database enforces unique fields for every row, so these use a model
+    # without database constraints and patch in the unique checks
+
+    def test_restore_raises_on_unique_conflict(self):
+        deleted = Child.objects.create(name='bill', deleted=True)
+        Child.objects.create(name='bill')
+        unique_checks = ([(Child, ('name',))], [])
+        with mock.patch.object(Child, '_get_unique_checks', return_value=unique_checks):
+            with self.assertRaisesMessage(ValidationError, 'Child with this Name already exists.'):
+                deleted.restore()
+        self.assertEqual(Child.objects.deleted().count(), 1)
+
+    def test_restore_raises_on_unique_together_conflict(self):
+        child = Child.objects.create(name='bill')
+        group = Group.objects.create(name='group')
+        Membership.objects.create(child=child, group=group, deleted=True)
+        Membership.objects.create(child=child, group=group)
+        unique_checks = ([(Membership, ('child', 'group'))], [])
+        with mock.patch.object(Membership, '_get_unique_checks', return_value=unique_checks):
+            with self.assertRaisesMessage(ValidationError, 'Membership with this Child and Group already exists.'):
+                Membership.objects.deleted().restore()
+
+    def test_restore_ignores_deleted_duplicates(self):
+        Child.objects.create(name='bill', deleted=True)
+        Child.objects.create(name='bill', deleted=True)
+        unique_checks = ([(Child, ('name',))], [])
+        with mock.patch.object(Child, '_get_unique_checks', return_value=unique_checks):
+            self.assertEqual(Child.objects.deleted().first().restore(), (1, {'tests.Child': 1}))
+
+    def test_restore_raises_on_duplicates_restored_together(self):
+        Child.objects.create(name='bill', deleted=True)
+        Child.objects.create(name='bill', deleted=True)
+        Child.objects.create(name='ben', deleted=True)
+        unique_checks = ([(Child, ('name',))], [])
+        with mock.patch.object(Child, '_get_unique_checks', return_value=unique_checks):
+            with self.assertRaisesMessage(ValidationError, 'Child with this Name already exists.'):
+                Child.objects.deleted().restore()
+        self.assertEqual(Child.objects.deleted().count(), 3)
+
+    def test_restore_raises_on_duplicates_in_different_batches(self):
+        Child.objects.create(name='bill', deleted=True)
+        Child.objects.create(name='ben', deleted=True)
+        Child.objects.create(name='bill', deleted=True)
+        unique_checks = ([(Child, ('name',))], [])
+        with mock.patch.object(Child, '_get_unique_checks', return_value=unique_checks):
+            with self.assertRaises(ValidationError):
+                Child.objects.deleted().restore(batch_size=1)
+        self.assertEqual(Child.objects.deleted().count(), 3)
+
+    def test_restore_raises_on_duplicates_across_the_cascade(self):
+        child = Child.objects.create(name='child')
+        Parent.objects.create(child=child, deleted=True)
+        Parent.objects.create(child=child, deleted=True)
+        Child.objects.filter(pk=child.pk).update(deleted=True)
+        unique_checks = ([(Parent, ('child',))], [])
+        with mock.patch.object(Parent, '_get_unique_checks', return_value=unique_checks):
+            with self.assertRaises(ValidationError):
+                child.restore()
+        self.assertEqual(Child.objects.deleted().count(), 1)
+
+    def test_restore_batch_raises_on_unique_conflict(self):
+        author = Author.objects.create(name='author')
+        book = Book.objects.create(author=author, title='book')
+        author.delete()
+        Author.objects.create(name='author')
+        unique_checks = ([(Author, ('name',))], [])
+        with mock.patch.object(Author, '_get_unique_checks', return_value=unique_checks):
+            with self.assertRaisesMessage(ValidationError, 'Author with this Name already exists.'):
+                Author.objects.restore_batch(author.deletion_batch)
+        self.assertEqual(Author.objects.deleted().get().pk, author.pk)
+        self.assertEqual(Book.objects.deleted().get().pk, book.pk)
+
+
+class DeferredDeleteTests(TestCase):
+
+    def setUp(self):
+        self.author = Author.objects.create(name='author')
+        self.book1 = Book.objects.create(author=self.author, title='book 1')
+        self.book2 = Book.objects.create(author=self.author, title='book 2')
+
+    def test_deferred_delete_only_flags_queryset(self):
+        self.assertEqual(Author.objects.filter(pk=self.author.pk).delete(deferred=True), (1, {'tests.Author': 1}))
+        self.assertEqual(Author.objects.count(), 0)
+        self.assertEqual(Book.objects.count(), 2)
+        job = SoftDeleteJob.objects.get()
+        self.assertEqual(job.model, 'tests.Author')
+        self.assertEqual(job.rows, 1)
+        self.assertFalse(job.finished)
+        self.assertEqual(job.batches.count(), 1)
+
+    def test_worker_finishes_cascade(self):
+        Author.objects.filter(pk=self.author.pk).delete(deferred=True)
+        self.assertEqual(process_jobs(), 2)
+        self.assertEqual(Book.objects.count(), 0)
+        author = Author.objects.all_with_deleted().get()
+        self.assertEqual(
+            set(Book.objects.deleted().values_list('deletion_batch', flat=True)), {author.deletion_batch})
+        job = SoftDeleteJob.objects.get()
+        self.assertTrue(job.finished)
+        self.assertEqual(job.rows, 3)
+        self.assertEqual(job.batches.count(), 0)
+
+    def test_worker_resumes(self):
+        Author.objects.filter(pk=self.author.pk).delete(deferred=True)
+        self.assertEqual(process_jobs(max_batches=1), 1)
+        self.assertEqual(Book.objects.count(), 0)
+        self.assertFalse(SoftDeleteJob.objects.get().finished)
+        self.assertEqual(process_jobs(), 1)
+        self.assertTrue(SoftDeleteJob.objects.get().finished)
+        self.assertEqual(process_jobs(), 0)
+
+    def test_batches_are_locked_without_their_job(self):
+        Author.objects.filter(pk=self.author.pk).delete(deferred=True)
+        with self.assertNumQueries(1) as queries:
+            batch = next_batch('default')
+        self.assertNotIn('JOIN', queries.captured_queries[0]['sql'])
+        self.assertEqual(batch.job, SoftDeleteJob.objects.get())
+
+    def test_instance_deferred_delete(self):
+        self.author.delete(deferred=True)
+        self.assertTrue(self.author.deleted)
+        self.assertIsNotNone(self.author.deletion_batch)
+        self.assertEqual(Book.objects.count(), 2)
+        process_jobs()
+        self.assertEqual(Book.objects.count(), 0)
+        Author.objects.restore_batch(self.author.deletion_batch)
+        self.assertEqual(Book.objects.count(), 2)
+
+    def test_nothing_to_delete_queues_nothing(self):
+        self.assertEqual(Author.objects.filter(pk=0).delete(deferred=True), (0, {}))
+        self.assertFalse(SoftDeleteJob.objects.exists())
+
+    def test_unsupported_options_raise(self):
+        with self.assertRaises(TypeError):
+            Author.objects.all().delete(bulk=False, deferred=True)
+        with self.assertRaises(TypeError):
+            self.author.delete(max_cascade_rows=10, deferred=True)
+        self.assertEqual(Author.objects.count(), 1)
+
+    @override_settings(SOFT_DELETE_MAX_CASCADE_ROWS=1)
+    def test_max_cascade_rows_setting_does_not_apply(self):
+        self.assertEqual(Author.objects.all().delete(deferred=True), (1, {'tests.Author': 1}))
+
+
 class ValidateUniqueTests(TestCase):
 
     def test_single_field_validates_correctly(self):
@@ -213,6 +1051,112 @@ class ValidateUniqueTests(TestCase):
         ):
             invalid.full_clean()
 
+    def test_unique_checks_use_one_query(self):
+        UniqueModel.objects.create(name='Bill', age=40, gender='male')
+        invalid = UniqueModel(name='Bill', age=40, gender='male')
+        with self.assertNumQueries(1):
+            errors = invalid._perform_unique_checks(invalid._get_unique_checks()[0])
+        self.assertEqual(ValidationError(errors).message_dict, {
+            'name': ['Unique model with this Name already exists.'],
+            NON_FIELD_ERRORS: ['Unique model with this Age and Gender already exists.'],
+        })
+
+    def test_unique_checks_exclude_the_object_being_edited(self):
+        obj = UniqueModel.objects.create(name='Bill', age=40, gender='male')
+        obj.full_clean()
+
+
+class ValidateUniqueBulkTests(TestCase):
+
+    def validate(self, objs, **kwargs):
+        errors = UniqueModel.objects.validate_unique_bulk(objs, **kwargs)
+        return {position: ValidationError(obj_errors).message_dict for position, obj_errors in errors.items()}
+
+    def test_valid_objects(self):
+        objs = [UniqueModel(name='Bill', age=40, gender='male'), UniqueModel(name='Ted', age=41, gender='male')]
+        self.assertEqual(self.validate(objs), {})
+
+    def test_clashes_with_database_rows(self):
+        UniqueModel.objects.create(name='Bill', age=40, gender='male', deleted=True)
+        objs = [
+            UniqueModel(name='Ted', age=41, gender='male'),
+            UniqueModel(name='Bill', age=42, gender='male'),
+            UniqueModel(name='Rufus', age=40, gender='male'),
+        ]
+        self.assertEqual(self.validate(objs), {
+            1: {'name': ['Unique model with this Name already exists.']},
+            2: {NON_FIELD_ERRORS: ['Unique model with this Age and Gender already exists.']},
+        })
+
+    def test_clashes_between_objects(self):
+        objs = [UniqueModel(name='Bill', age=40, gender='male'), UniqueModel(name='Bill', age=41, gender='male')]
+        self.assertEqual(self.validate(objs), {
+            1: {'name': ['Unique model with this Name already exists.']},
+        })
+
+    def test_queries_are_batched(self):
+        objs = [UniqueModel(name='name %d' % i, age=i, gender='male') for i in range(5)]
+        # two unique checks, three batches each
+        with self.assertNumQueries(6):
+            UniqueModel.objects.validate_unique_bulk(objs, batch_size=2)
+
+    def test_edited_objects_do_not_clash_with_their_own_row(self):
+        obj = UniqueModel.objects.create(name='Bill', age=40, gender='male')
+        self.assertEqual(self.validate([obj]), {})
+
+
+class ActiveConstraintTests(TestCase):
+
+    @skipIf(supports_conditions(), 'conditions are supported')
+    def test_helpers_need_condition_support(self):
+        with self.assertRaises(ImproperlyConfigured):
+            active_unique_constraint(['name'], 'unique_active_name')
+        with self.assertRaises(ImproperlyConfigured):
+            active_index(['name'], 'active_name')
+
+    @skipUnless(supports_conditions(), 'conditions are not supported')
+    def test_active_unique_constraint(self):
+        constraint = active_unique_constraint(['name'], 'unique_active_name')
+        self.assertEqual(constraint.condition, Q(deleted=False))
+        self.assertTrue(is_active_unique_constraint(constraint))
+
+    def test_no_active_unique_checks_without_constraints(self):
+        self.assertEqual(active_unique_checks(UniqueModel), [])
+
+    def test_check_passes_without_active_constraints(self):
+        self.assertEqual(check_active_unique_constraints(), [])
+
+
+class InstanceDeleteTests(TestCase):
+
+    def test_only_deletion_fields_written(self):
+        author = Author.objects.create(name='author')
+        with self.assertNumQueries(2) as queries:
+            author.delete()
+        sql = queries.captured_queries[-1]['sql']
+        self.assertIn('"deletion_batch"', sql)
+        self.assertNotIn('"name"', sql)
+
+    def test_concurrent_edits_are_kept(self):
+        child = Child.objects.create(name='child')
+        Child.objects.filter(pk=child.pk).update(name='renamed')
+        child.delete()
+        self.assertEqual(Child.objects.deleted().get().name, 'renamed')
+
+    def test_post_save_sent_with_update_fields(self):
+        author = Author.objects.create(name='author')
+        update_fields = []
+
+        def receiver(sender, **kwargs):
+            update_fields.append(kwargs['update_fields'])
+
+        post_save.connect(receiver, sender=Author)
+        try:
+            author.delete()
+        finally:
+            post_save.disconnect(receiver, sender=Author)
+        self.assertEqual(update_fields, [frozenset(['deleted', 'deleted_at', 'deletion_batch'])])
+
 
 class ModelAbstractTests(TestCase):
 
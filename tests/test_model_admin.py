@@ -1,9 +1,14 @@
 from django import forms
 from django.contrib import admin
-from django.test import TestCase
+from django.contrib.auth.models import Permission, User
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.db import models
+from django.test import RequestFactory, TestCase
 
-from soft_delete.helpers import set_soft_delete_foreign_key
-from .models import Child, Parent
+from soft_delete.admin import SoftDeleteListFilter, restore_selected, soft_delete_selected
+from soft_delete.helpers import set_soft_delete_foreign_key, set_soft_delete_formset_foreign_key
+from .models import Child, City, Country, Parent
 
 
 class MockRequest(object):
@@ -99,3 +104,138 @@ class ModelAdminTests(TestCase):
             '<option value="%d" selected="selected">child 2</option>'
             '</select></div>' % (child1.id, child2.id)
         )
+
+
+class FormsetForeignKeyTests(TestCase):
+
+    def setUp(self):
+        self.child1 = Child.objects.create(name='child 1')
+        self.child2 = Child.objects.create(name='child 2', deleted=True)
+        self.child3 = Child.objects.create(name='child 3', deleted=True)
+        self.parent1 = Parent.objects.create(child=self.child1)
+        self.parent2 = Parent.objects.create(child=self.child2)
+        self.formset_class = forms.modelformset_factory(Parent, fields=('child',), extra=1)
+
+    def options(self, form):
+        return [value for value, label in form.fields['child'].widget.choices]
+
+    def test_choices_fetched_once_for_all_forms(self):
+        with self.assertNumQueries(2):
+            formset = set_soft_delete_formset_foreign_key(
+                self.formset_class(queryset=Parent.objects.order_by('pk')), 'child', Child)
+            for form in formset.forms:
+                str(form['child'])
+        for form in formset.forms:
+            self.assertEqual(self.options(form), ['', self.child1.pk, self.child2.pk])
+
+    def test_lazy_choices_are_only_selected(self):
+        Child.objects.create(name='child 4')
+        formset = set_soft_delete_formset_foreign_key(
+            self.formset_class(queryset=Parent.objects.order_by('pk')), 'child', Child, lazy=True)
+        self.assertEqual(self.options(formset.forms[0]), ['', self.child1.pk, self.child2.pk])
+        self.assertEqual(formset.forms[0].fields['child'].queryset.count(), 3)
+
+    def test_selected_deleted_rows_validate(self):
+        formset = set_soft_delete_formset_foreign_key(self.formset_class(queryset=Parent.objects.all()), 'child', Child)
+        field = formset.forms[1].fields['child']
+        self.assertEqual(field.clean(str(self.child2.pk)), self.child2)
+        with self.assertRaises(ValidationError):
+            field.clean(str(self.child3.pk))
+
+    def test_foreign_keys_to_other_fields(self):
+        Country.objects.create(code='fr')
+        Country.objects.create(code='it', deleted=True)
+        deleted = Country.objects.create(code='de', deleted=True)
+        city = City.objects.create(country=deleted)
+        formset_class = forms.modelformset_factory(City, fields=('country',), extra=0)
+        formset = set_soft_delete_formset_foreign_key(formset_class(queryset=City.objects.all()), 'country', Country)
+        self.assertEqual(
+            sorted(formset.forms[0].fields['country'].queryset.values_list('code', flat=True)), ['de', 'fr'])
+        formset = set_soft_delete_formset_foreign_key(
+            formset_class(queryset=City.objects.all()), 'country', Country, lazy=True)
+        self.assertEqual([value for value, label in formset.forms[0].fields['country'].choices], ['', 'de'])
+        field = forms.ModelChoiceField(Country.objects.all(), to_field_name='code')
+        set_soft_delete_foreign_key(field, city, 'country', Country)
+        self.assertEqual(sorted(field.queryset.values_list('code', flat=True)), ['de', 'fr'])
+
+
+class ActiveAdminTests(TestCase):
+
+    def setUp(self):
+        Parent._meta.get_field('child').rel.on_delete = models.CASCADE
+        self.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.model_admin = admin.site._registry[Child]
+        self.child1 = Child.objects.create(name='child 1')
+        self.child2 = Child.objects.create(name='child 2', deleted=True)
+        Parent.objects.create(child=self.child1)
+        Parent.objects.create(child=self.child1)
+
+    def tearDown(self):
+        Parent._meta.get_field('child').rel.on_delete = models.DO_NOTHING
+
+    def request(self, data=None, params=None):
+        if data is None:
+            request = RequestFactory().get('/', params or {})
+        else:
+            request = RequestFactory().post('/', data)
+        request.user = self.user
+        request._messages = CookieStorage(request)
+        return request
+
+    def test_list_filter_defaults_to_active(self):
+        self.assertEqual(self.model_admin.get_list_filter(self.request())[0], SoftDeleteListFilter)
+        queryset = self.model_admin.get_queryset(self.request())
+        self.assertEqual(queryset.count(), 2)
+        list_filter = SoftDeleteListFilter(self.request(), {}, Child, self.model_admin)
+        self.assertEqual(list(list_filter.queryset(None, queryset)), [self.child1])
+        list_filter = SoftDeleteListFilter(self.request(), {'deleted': 'deleted'}, Child, self.model_admin)
+        self.assertEqual(list(list_filter.queryset(None, queryset)), [self.child2])
+        list_filter = SoftDeleteListFilter(self.request(), {'deleted': 'all'}, Child, self.model_admin)
+        self.assertEqual(list(list_filter.queryset(None, queryset)), [self.child1, self.child2])
+
+    def test_actions_replace_delete_selected(self):
+        actions = self.model_admin.get_actions(self.request())
+        self.assertNotIn('delete_selected', actions)
+        self.assertIn('soft_delete_selected', actions)
+        self.assertIn('restore_selected', actions)
+
+    def test_confirmation_shows_counts(self):
+        response = soft_delete_selected(self.model_admin, self.request(data={}), Child.objects.all_with_deleted())
+        self.assertEqual(response.context_data['counts'], [('childs', 1), ('parents', 2)])
+        response.render()
+        self.assertContains(response, '<li>Parents: 2</li>', html=True)
+        self.assertContains(response, 'name="_selected_action" value="%d"' % self.child1.pk)
+        self.assertEqual(Child.objects.count(), 1)
+
+    def test_soft_delete_confirmed(self):
+        request = self.request(data={'post': 'yes'})
+        self.assertIsNone(soft_delete_selected(self.model_admin, request, Child.objects.all()))
+        self.assertEqual(Child.objects.count(), 0)
+        self.assertEqual(Parent.objects.count(), 0)
+        self.assertEqual([m.message for m in request._messages], ['Soft deleted 3 rows.'])
+
+    def test_soft_delete_needs_permission_for_the_cascade(self):
+        self.user = User.objects.create_user('staff', 'staff@example.com', 'password', is_staff=True)
+        self.user.user_permissions.add(Permission.objects.get(codename='delete_child'))
+        response = soft_delete_selected(self.model_admin, self.request(data={}), Child.objects.all())
+        self.assertEqual(response.context_data['title'], 'Cannot soft delete childs')
+        self.assertEqual(response.context_data['perms_lacking'], ['parent'])
+        response.render()
+        self.assertContains(response, '<li>parent</li>', html=True)
+        self.assertNotContains(response, 'name="post"')
+        with self.assertRaises(PermissionDenied):
+            soft_delete_selected(self.model_admin, self.request(data={'post': 'yes'}), Child.objects.all())
+        self.assertEqual(Child.objects.count(), 1)
+        self.assertEqual(Parent.objects.count(), 2)
+
+        self.user.user_permissions.add(Permission.objects.get(codename='delete_parent'))
+        self.user = User.objects.get(pk=self.user.pk)
+        request = self.request(data={'post': 'yes'})
+        self.assertIsNone(soft_delete_selected(self.model_admin, request, Child.objects.all()))
+        self.assertEqual(Parent.objects.count(), 0)
+
+    def test_restore(self):
+        request = self.request(data={})
+        restore_selected(self.model_admin, request, Child.objects.all_with_deleted())
+        self.assertEqual(Child.objects.count(), 2)
+        self.assertEqual([m.message for m in request._messages], ['Restored 1 rows.'])
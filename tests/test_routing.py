@@ -0,0 +1,163 @@
+from unittest import mock, skipUnless
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from soft_delete.deferred import process_jobs
+from soft_delete.models import SoftDeleteJob
+from soft_delete.triggers import create_trigger_sql, trigger_cascade
+
+from soft_delete.signals import soft_delete_level
+
+from .models import Author, Book, CachedChild, Child, ShardLeaf, ShardRoot
+
+
+class UsingTests(TestCase):
+    multi_db = True
+
+    def setUp(self):
+        self.active = Child.objects.using('other').create(name='active')
+        self.deleted = Child.objects.using('other').create(name='deleted', deleted=True)
+        Child.objects.create(name='default', deleted=True)
+
+    def test_using_is_honored(self):
+        self.assertEqual(list(Child.objects.using('other')), [self.active])
+        self.assertEqual(list(Child.objects.using('other').deleted()), [self.deleted])
+        self.assertEqual(Child.objects.using('other').all_with_deleted().count(), 2)
+        self.assertEqual(
+            list(Child.objects.using('other').all_including_by_pk(self.deleted.pk)), [self.active, self.deleted])
+        self.assertEqual(list(Child.objects.db_manager('other').deleted()), [self.deleted])
+
+    def test_filtered_querysets_keep_their_filters(self):
+        self.assertEqual(list(Child.objects.using('other').filter(name='active').deleted()), [])
+        with self.assertRaises(TypeError):
+            Child.objects.filter(name='active').all_with_deleted()
+
+    def test_deferred_job_is_queued_with_the_rows(self):
+        author = Author.objects.using('other').create(name='author')
+        Book.objects.using('other').create(author=author, title='book')
+        Author.objects.using('other').all().delete(deferred=True)
+        self.assertFalse(SoftDeleteJob.objects.exists())
+        self.assertEqual(SoftDeleteJob.objects.using('other').count(), 1)
+        self.assertEqual(process_jobs(using='other'), 2)
+        self.assertEqual(Book.objects.using('other').deleted().count(), 1)
+
+    def test_instance_preview_and_restore_use_the_instance_database(self):
+        self.active.delete()
+        self.assertEqual(self.active.delete_preview(), (0, {}, {}))
+        self.assertEqual(self.active.restore(), (1, {'tests.Child': 1}))
+        self.assertFalse(self.active.deleted)
+        self.assertEqual(list(Child.objects.using('other')), [self.active])
+        self.assertEqual(self.active.delete_preview(), (1, {'tests.Child': 1}, {}))
+
+    def test_instance_restore_leaves_the_object_when_nothing_is_restored(self):
+        child = Child(name='unsaved', deleted=True)
+        self.assertEqual(child.restore(), (0, {}))
+        self.assertTrue(child.deleted)
+
+
+@override_settings(DATABASE_ROUTERS=['tests.routers.ReplicaRouter'])
+class ReplicaCacheTests(TransactionTestCase):
+    multi_db = True
+
+    def setUp(self):
+        cache.clear()
+        self.child = CachedChild.objects.create(name='child')
+        # replicated
+        CachedChild(pk=self.child.pk, name='child').save(using='other')
+
+    def test_writes_to_the_primary_invalidate_replica_reads(self):
+        self.assertFalse(CachedChild.objects.get(pk=self.child.pk).deleted)
+        self.child.delete()
+        CachedChild._base_manager.using('other').update(deleted=True)
+        self.assertTrue(CachedChild.objects.get(pk=self.child.pk).deleted)
+
+
+class ShardedCascadeTests(TestCase):
+    multi_db = True
+
+    def setUp(self):
+        self.root = ShardRoot.objects.create(name='root')
+        self.leaves = [ShardLeaf.objects.create(root=self.root) for i in range(3)]
+
+    def test_leaves_are_routed(self):
+        self.assertEqual(ShardLeaf.objects.db_manager('other').count(), 3)
+
+    def test_bulk_delete_and_restore_across_databases(self):
+        self.assertEqual(
+            ShardRoot.objects.all().delete(), (4, {'tests.ShardRoot': 1, 'tests.ShardLeaf': 3}))
+        self.assertEqual(ShardLeaf.objects.count(), 0)
+        self.assertEqual(ShardLeaf.objects.deleted().count(), 3)
+        self.assertEqual(
+            ShardRoot.objects.deleted().restore(), (4, {'tests.ShardRoot': 1, 'tests.ShardLeaf': 3}))
+        self.assertEqual(ShardLeaf.objects.count(), 3)
+
+    def test_instance_delete_across_databases(self):
+        self.root.delete()
+        self.assertEqual(ShardLeaf.objects.deleted().count(), 3)
+
+    @skipUnless(connection.vendor in ('postgresql', 'sqlite'), 'triggers need PostgreSQL or SQLite')
+    def test_triggers_do_not_span_databases(self):
+        with connection.cursor() as cursor:
+            for sql in create_trigger_sql(ShardRoot, connection):
+                cursor.execute(sql)
+        with mock.patch.object(ShardRoot, 'soft_delete_triggers', True):
+            self.assertEqual(trigger_cascade(ShardRoot, connection), (True, False))
+            self.root.delete()
+        self.assertEqual(ShardLeaf.objects.deleted().count(), 3)
+
+    def test_preview_across_databases(self):
+        self.assertEqual(
+            ShardRoot.objects.all().delete_preview()[:2], (4, {'tests.ShardRoot': 1, 'tests.ShardLeaf': 3}))
+
+    def test_other_databases_roll_back_with_the_delete(self):
+        def fail(sender, level, **kwargs):
+            if level == 1:
+                raise ValueError
+
+        soft_delete_level.connect(fail)
+        try:
+            with self.assertRaises(ValueError):
+                ShardRoot.objects.all().delete()
+        finally:
+            soft_delete_level.disconnect(fail)
+        self.assertEqual(ShardRoot.objects.count(), 1)
+        self.assertEqual(ShardLeaf.objects.count(), 3)
+
+    @override_settings(SOFT_DELETE_CONCURRENT_DATABASES=True)
+    def test_concurrent_in_a_transaction_runs_in_the_calling_thread(self):
+        # other connections could not see the rows of the test's transaction
+        self.assertEqual(ShardRoot.objects.all().delete()[0], 4)
+        self.assertEqual(ShardLeaf.objects.deleted().count(), 3)
+
+
+@override_settings(SOFT_DELETE_CONCURRENT_DATABASES=True)
+class ConcurrentShardedCascadeTests(TransactionTestCase):
+    multi_db = True
+
+    def setUp(self):
+        self.root = ShardRoot.objects.create(name='root')
+        self.leaves = [ShardLeaf.objects.create(root=self.root) for i in range(3)]
+
+    def test_bulk_delete_and_restore_across_databases(self):
+        self.assertEqual(
+            ShardRoot.objects.all().delete(), (4, {'tests.ShardRoot': 1, 'tests.ShardLeaf': 3}))
+        self.assertEqual(ShardLeaf.objects.deleted().count(), 3)
+        self.assertEqual(
+            ShardRoot.objects.deleted().restore(), (4, {'tests.ShardRoot': 1, 'tests.ShardLeaf': 3}))
+        self.assertEqual(ShardLeaf.objects.count(), 3)
+
+    def test_other_databases_roll_back_with_the_delete(self):
+        def fail(sender, level, **kwargs):
+            if level == 1:
+                raise ValueError
+
+        soft_delete_level.connect(fail)
+        try:
+            with self.assertRaises(ValueError):
+                ShardRoot.objects.all().delete()
+        finally:
+            soft_delete_level.disconnect(fail)
+        self.assertEqual(ShardRoot.objects.count(), 1)
+        self.assertEqual(ShardLeaf.objects.count(), 3)
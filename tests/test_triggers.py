@@ -0,0 +1,146 @@
+from unittest import mock, skipUnless
+
+from django.apps import apps
+from django.db import connection
+from django.db.migrations.state import ProjectState
+from django.test import TestCase, override_settings
+
+from soft_delete.checks import check_soft_delete_triggers
+from soft_delete.triggers import (
+    InstallSoftDeleteTriggers, create_trigger_sql, drop_trigger_sql, trigger_cascade, trigger_name)
+from .models import Author, BenchmarkBranch, BenchmarkLeaf, BenchmarkNode, BenchmarkRoot, Book, Topic
+
+
+def install_triggers(*models):
+    with connection.cursor() as cursor:
+        for model in models:
+            for sql in create_trigger_sql(model, connection):
+                cursor.execute(sql)
+
+
+@skipUnless(connection.vendor in ('postgresql', 'sqlite'), 'triggers need PostgreSQL or SQLite')
+class TriggerTests(TestCase):
+
+    def setUp(self):
+        self.author = Author.objects.create(name='author')
+        self.book1 = Book.objects.create(author=self.author, title='book 1')
+        self.book2 = Book.objects.create(author=self.author, title='book 2')
+
+    def test_sql_copies_tracked_fields(self):
+        sql = ' '.join(create_trigger_sql(Author, connection))
+        self.assertIn('"deleted_at" = NEW."deleted_at"', sql)
+        self.assertIn('"deletion_batch" = NEW."deletion_batch"', sql)
+        self.assertIn('WHERE "author_id" = NEW."id"', sql)
+
+    def test_no_sql_without_cascade(self):
+        self.assertEqual(create_trigger_sql(Book, connection), [])
+
+    def test_not_used_until_enabled(self):
+        install_triggers(Author)
+        self.assertEqual(trigger_cascade(Author, connection), (False, False))
+        with mock.patch.object(Author, 'soft_delete_triggers', True, create=True):
+            self.assertEqual(trigger_cascade(Author, connection), (True, True))
+
+    def test_queryset_delete_is_one_update(self):
+        install_triggers(Author)
+        with mock.patch.object(Author, 'soft_delete_triggers', True):
+            with self.assertNumQueries(3):
+                self.assertEqual(Author.objects.all().delete(), (1, {'tests.Author': 1}))
+        self.assertEqual(Book.objects.count(), 0)
+        author = Author.objects.deleted().get()
+        self.assertEqual(
+            set(Book.objects.deleted().values_list('deletion_batch', 'deleted_at')),
+            {(author.deletion_batch, author.deleted_at)})
+
+    def test_instance_delete(self):
+        install_triggers(Author)
+        with mock.patch.object(Author, 'soft_delete_triggers', True):
+            self.author.delete()
+        self.assertEqual(Book.objects.count(), 0)
+        self.assertEqual(Book.objects.deleted().count(), 2)
+
+    def test_rows_already_deleted_keep_their_batch(self):
+        install_triggers(Author)
+        self.book1.delete()
+        book1 = Book.objects.deleted().get()
+        with mock.patch.object(Author, 'soft_delete_triggers', True):
+            Author.objects.all().delete()
+        self.assertEqual(Book.objects.deleted().get(pk=book1.pk).deletion_batch, book1.deletion_batch)
+
+    def test_partial_triggers_fall_back_to_python(self):
+        install_triggers(BenchmarkRoot)
+        root = BenchmarkRoot.objects.create(name='root')
+        branch = BenchmarkBranch.objects.create(root=root)
+        BenchmarkLeaf.objects.create(branch=branch)
+        with mock.patch.object(BenchmarkRoot, 'soft_delete_triggers', True):
+            self.assertEqual(trigger_cascade(BenchmarkRoot, connection), (True, False))
+            self.assertEqual(BenchmarkRoot.objects.all().delete()[0], 3)
+        self.assertEqual(BenchmarkLeaf.objects.count(), 0)
+
+    def test_cascades_to_other_models_are_left_to_python(self):
+        self.assertEqual(create_trigger_sql(Topic, connection), [])
+        with mock.patch.object(Topic, 'soft_delete_triggers', True):
+            self.assertEqual(trigger_cascade(Topic, connection), (True, False))
+
+    @skipUnless(connection.vendor == 'sqlite', 'sqlite only')
+    def test_sqlite_rejects_self_cascade(self):
+        with self.assertRaises(ValueError):
+            create_trigger_sql(BenchmarkNode, connection)
+
+
+@skipUnless(connection.vendor in ('postgresql', 'sqlite'), 'triggers need PostgreSQL or SQLite')
+class InstallSoftDeleteTriggersTests(TestCase):
+
+    def trigger_exists(self):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = %s",
+                               [trigger_name(Author, connection)])
+            else:
+                cursor.execute('SELECT 1 FROM pg_trigger WHERE tgname = %s', [trigger_name(Author, connection)])
+            return cursor.fetchone() is not None
+
+    def test_forwards_and_backwards(self):
+        operation = InstallSoftDeleteTriggers('Author')
+        state = ProjectState.from_apps(apps)
+        with connection.schema_editor() as editor:
+            operation.database_forwards('tests', editor, state, state)
+        self.assertTrue(self.trigger_exists())
+        with connection.schema_editor() as editor:
+            operation.database_forwards('tests', editor, state, state)
+        self.assertTrue(self.trigger_exists())
+        with connection.schema_editor() as editor:
+            operation.database_backwards('tests', editor, state, state)
+        self.assertFalse(self.trigger_exists())
+
+    def test_deconstruct(self):
+        self.assertEqual(
+            InstallSoftDeleteTriggers('Author').deconstruct(), ('InstallSoftDeleteTriggers', ['Author'], {}))
+        self.assertEqual(len(drop_trigger_sql(Author, connection)), 1 if connection.vendor == 'sqlite' else 2)
+
+
+class TriggerCheckTests(TestCase):
+
+    def check(self):
+        with mock.patch.object(Author, 'soft_delete_triggers', True):
+            return [error.id for error in check_soft_delete_triggers([apps.get_app_config('tests')])]
+
+    def test_not_checked_when_unused(self):
+        self.assertEqual(check_soft_delete_triggers([apps.get_app_config('tests')]), [])
+
+    def test_not_checked_without_migrations(self):
+        self.assertEqual(self.check(), [])
+
+    @override_settings(MIGRATION_MODULES={'tests': 'tests.trigger_migrations.current'})
+    def test_current_trigger(self):
+        self.assertEqual(self.check(), [])
+
+    @override_settings(MIGRATION_MODULES={'tests': 'tests.trigger_migrations.stale'})
+    def test_stale_trigger(self):
+        self.assertEqual(self.check(), ['soft_delete.E002'])
+
+    @override_settings(MIGRATION_MODULES={'tests': 'tests.trigger_migrations.stale'})
+    def test_missing_trigger(self):
+        with mock.patch.object(Book, 'soft_delete_triggers', True, create=True):
+            errors = check_soft_delete_triggers([apps.get_app_config('tests')])
+        self.assertEqual([error.id for error in errors], ['soft_delete.E001'])
@@ -0,0 +1,22 @@
+from django.db import migrations, models
+
+from soft_delete.triggers import InstallSoftDeleteTriggers
+
+
+class Migration(migrations.Migration):
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name='Author',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('deleted', models.BooleanField(db_index=True, default=False, editable=False)),
+                ('deleted_at', models.DateTimeField(editable=False, null=True)),
+                ('deletion_batch', models.UUIDField(db_index=True, editable=False, null=True)),
+                ('name', models.CharField(max_length=20)),
+            ],
+        ),
+        InstallSoftDeleteTriggers('Author'),
+    ]
@@ -0,0 +1,23 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tests', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Book',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('deleted', models.BooleanField(db_index=True, default=False, editable=False)),
+                ('deleted_at', models.DateTimeField(editable=False, null=True)),
+                ('deletion_batch', models.UUIDField(db_index=True, editable=False, null=True)),
+                ('title', models.CharField(max_length=20)),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tests.Author')),
+            ],
+        ),
+    ]